@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import testUtils
+from grading import grade_submission, to_junit
+
+
+def init_worker(warm: bool) -> None:
+    """
+        Prepare a worker process of the pool.
+        Workers leave through `os._exit`, which skips `atexit`, so the
+        warm interpreter is stopped by a multiprocessing finalizer.
+        A worker that is killed closes the warm interpreter's stdin,
+        which stops it as well.
+    """
+    if warm:
+        testUtils.use_warm_interpreter()
+        Finalize(None, testUtils.use_warm_interpreter, args=(False,), exitpriority=10)
+
+
+def find_submissions(submissions_dir: str) -> List[str]:
+    """
+        Every directory directly inside `submissions_dir` is a submission.
+    """
+    return sorted(
+        entry.path for entry in os.scandir(submissions_dir) if entry.is_dir()
+    )
+
+
+def grade_all(test_file: str, submission_dirs: List[str],
+              workers: Optional[int] = None,
+              warm: Optional[bool] = False,
+              store_dir: Optional[str] = None,
+              force: Optional[bool] = False) -> List[Dict[str, Any]]:
+    """
+        Grade all submissions on a process pool.
+        Results are returned in the order of `submission_dirs`.
+    """
+    test_file = os.path.abspath(test_file)
+    store_dir = store_dir and os.path.abspath(store_dir)
+    results: Dict[str, Dict[str, Any]] = {}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(warm,)) as pool:
+        futures = {
+            pool.submit(grade_submission, test_file, source_dir, store_dir, force): source_dir
+            for source_dir in submission_dirs
+        }
+        for future in as_completed(futures):
+            report = future.result()
+            results[futures[future]] = report
+            print(f"{report['name']}: {report['passed']}/{report['total']} passed, "
+                  f"{report['reused']} reused ({len(results)}/{len(futures)})", file=sys.stderr)
+
+    return [results[source_dir] for source_dir in submission_dirs]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Grade a directory of submissions in parallel. "
+                    "Every subdirectory is used as SOURCE_DIR for one run of the tests."
+    )
+    parser.add_argument('submissions', help="directory containing one directory per submission")
+    parser.add_argument('-t', '--tests', default='python-test.py',
+                        help="test file to run against every submission (default: %(default)s)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('-f', '--format', choices=['json', 'junit'], default='json',
+                        help="report format (default: %(default)s)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="report file, '-' for stdout (default: %(default)s)")
+    parser.add_argument('--warm', action='store_true',
+                        help="run student files through a warm interpreter in every worker")
+    parser.add_argument('--store', default='.blast-results',
+                        help="directory storing test outcomes, tests whose student files "
+                             "didn't change reuse them (default: %(default)s)")
+    parser.add_argument('--force', action='store_true',
+                        help="run every test, even if its stored outcome could be reused")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    reports = grade_all(args.tests, find_submissions(args.submissions),
+                        args.workers, args.warm, args.store, args.force)
+
+    if args.format == 'junit':
+        report = to_junit(reports)
+    else:
+        report = json.dumps({
+            'tests': args.tests,
+            'time': time.perf_counter() - started,
+            'submissions': reports,
+        }, indent=2)
+
+    if args.output == '-':
+        print(report)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as open_file:
+            open_file.write(report)
@@ -0,0 +1,218 @@
+"""
+    Measure how grading time scales: every `lint_jupyter_notebook` check
+    on generated notebooks and `run_student_file` on generated programs.
+
+    Usage: python benchmarks/bench_grading.py [--repeat N] [-o results.json] [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import unittest
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import testUtils
+
+
+def generate_notebook(cells: int, headers: int, imports: int, rng: random.Random) -> Dict:
+    """
+        Generate a notebook of exactly `cells` cells (at least four)
+        that passes the lint checks: a title with a description,
+        `headers` headers including the title, and `imports` modules
+        that are imported in the first code cell and used at random
+        further on.
+    """
+    modules = [f"module_{i}" for i in range(imports)]
+    sources = [
+        ('markdown', "# Generated notebook\n\nA notebook generated to benchmark the lint checks."),
+        # Using every module next to its import keeps the imports under the title
+        ('code', "\n".join([f"import {module}" for module in modules] + [f"modules = [{', '.join(modules)}]"])),
+    ]
+    # Every further code cell follows a markdown cell, some of which are section headers
+    code_cells = max((cells - 2) // 2, 1)
+    sections = min(max(headers - 1, 0), code_cells)
+    section_starts = {k * code_cells // sections for k in range(sections)}
+    level = 1
+    for i in range(code_cells):
+        # Sections are nested at most one level deeper
+        if i in section_starts:
+            level = rng.randint(2, min(level + 1, 3))
+            sources.append(('markdown', f"{'#' * level} Section {i}\n\nExplanation of section {i}."))
+        else:
+            sources.append(('markdown', f"Explanation of step {i}."))
+        lines = [f"value_{i}_{k} = {rng.choice(modules) if modules else 'len'}({k})" for k in range(rng.randint(2, 20))]
+        lines.append(f"print(value_{i}_0)")
+        sources.append(('code', "\n".join(lines)))
+    if len(sources) < cells:
+        sources.append(('markdown', "That's all."))
+
+    return {
+        'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5,
+        'cells': [
+            {'cell_type': cell_type, 'metadata': {}, 'source': source.splitlines(True),
+             **({'outputs': [], 'execution_count': None} if cell_type == 'code' else {})}
+            for cell_type, source in sources
+        ],
+    }
+
+
+def generate_program(output_lines: int, line_length: int, inputs: int) -> str:
+    """
+        Generate a student program that reads `inputs` lines from stdin
+        and writes `output_lines` lines of `line_length` characters.
+    """
+    return (
+        f"answers = [input() for _ in range({inputs})]\n"
+        f"line = 'x' * {line_length}\n"
+        f"for i in range({output_lines}):\n"
+        f"    print(line)\n"
+        f"print(len(answers))\n"
+    )
+
+
+def best_of(func: Callable[[], object], repeat: int,
+            setup: Optional[Callable[[], None]] = None) -> float:
+    """
+        Time a function, best of `repeat` runs. `setup` runs before
+        every run and is not timed.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def clear_notebook_caches() -> None:
+    testUtils._notebook_models.clear()
+    testUtils.parse_code.cache_clear()
+    testUtils.find_used_identifiers.cache_clear()
+
+
+def run_check(test: unittest.TestCase, name: str) -> None:
+    # Generated notebooks pass every check, a failure shouldn't stop the benchmark though
+    try:
+        getattr(test, name)()
+    except AssertionError:
+        pass
+
+
+def bench_notebooks(directory: str, repeat: int) -> Dict[str, float]:
+    rng = random.Random(0)
+    workloads = {
+        'cells_10': (10, 3, 3),
+        'cells_100': (100, 10, 10),
+        'cells_1000': (1000, 50, 30),
+        'headers_200': (400, 200, 10),
+        'imports_200': (100, 10, 200),
+    }
+    results = {}
+    for workload, (cells, headers, imports) in workloads.items():
+        file_name = f"{workload}.ipynb"
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as open_file:
+            json.dump(generate_notebook(cells, headers, imports, rng), open_file)
+
+        @testUtils.lint_jupyter_notebook(file_name)
+        class Checks(unittest.TestCase):
+            pass
+
+        path = testUtils.SOURCE_DIR + file_name
+        results[f"notebook/{workload}/load"] = best_of(
+            lambda: testUtils.load_notebook_model(path), repeat, clear_notebook_caches
+        )
+        names = sorted(name for name in dir(Checks) if name.startswith('test_'))
+        prefix = os.path.commonprefix(names)
+        for name in names:
+            # The model is shared by the checks, so it is loaded before timing
+            results[f"notebook/{workload}/{name[len(prefix):]}"] = best_of(
+                lambda: run_check(Checks(name), name), repeat,
+                lambda: (clear_notebook_caches(), testUtils.load_notebook_model(path)),
+            )
+    return results
+
+
+def bench_programs(directory: str, repeat: int) -> Dict[str, float]:
+    workloads = {
+        'hello': (1, 10, 0),
+        'output_1k_lines': (1_000, 80, 0),
+        'output_100k_lines': (100_000, 80, 0),
+        'output_8mb': (1_000, 8_000, 0),
+        'inputs_1k': (1, 10, 1_000),
+        'inputs_100k': (1, 10, 100_000),
+    }
+    results = {}
+    for warm in (False, True):
+        testUtils.use_warm_interpreter(warm)
+        mode = 'warm' if warm else 'direct'
+        for workload, (output_lines, line_length, inputs) in workloads.items():
+            file_name = f"{workload}.py"
+            with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as open_file:
+                open_file.write(generate_program(output_lines, line_length, inputs))
+            arguments = [str(i) for i in range(inputs)]
+            results[f"run_student_file/{mode}/{workload}"] = best_of(
+                lambda: testUtils.run_student_file(file_name, arguments, cache=False), repeat
+            )
+    testUtils.use_warm_interpreter(False)
+    return results
+
+
+def run(repeat: int) -> Dict[str, Dict]:
+    with tempfile.TemporaryDirectory(prefix='blast-bench-') as directory:
+        testUtils.SOURCE_DIR = os.path.join(directory, '')
+        results = {**bench_notebooks(directory, repeat), **bench_programs(directory, repeat)}
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """
+        Describe how every measurement changed relative to a baseline.
+        Measurements more than `threshold` times slower are marked.
+    """
+    lines = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            lines.append(f"  {name}: {seconds * 1000:.2f} ms (new)")
+            continue
+        ratio = seconds / baseline[name] if baseline[name] > 0 else float('inf')
+        marker = "  SLOWER" if ratio > threshold else ""
+        lines.append(f"  {name}: {seconds * 1000:.2f} ms ({ratio:.2f}x baseline){marker}")
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement (default: %(default)s)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="results file, '-' for stdout (default: %(default)s)")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="earlier results file to compare with, printed to stderr")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="ratio to the baseline reported as slower (default: %(default)s)")
+    args = parser.parse_args()
+
+    report = run(args.repeat)
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w', encoding='utf-8') as open_file:
+            json.dump(report, open_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as open_file:
+            baseline = json.load(open_file)['results']
+        print("\n".join(compare(report['results'], baseline, args.threshold)), file=sys.stderr)
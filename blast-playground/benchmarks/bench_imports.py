@@ -0,0 +1,152 @@
+"""
+    Compare the AST based import analysis of testUtils with
+    the regular expressions it replaced, on generated notebooks.
+
+    Usage: python benchmarks/bench_imports.py [--repeat N] [--timeout SECONDS]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+from typing import Callable, Dict, Generator, Iterator, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import testUtils
+
+
+def regex_find_imported_modules(code: str) -> Generator[str, None, None]:
+    """
+        The regular expression based import detection that was
+        used before `testUtils.find_imported_modules`.
+    """
+    discovered = re.findall(
+        r"(?:from [\w.\-]+)?\s*import (?:((?:(?: *[\w.\-]+(?: as [\w.\-]+)?),? *)+)|(?:\(\s*)((?:(?: *[\w.\-]+(?: as [\w.\-]+)?),?\s*)+)(?:\s*\))|(?:\*))",
+        code
+    )
+
+    for line in discovered:
+        for option in line:
+            for mod in re.findall(
+                    r"(?:(?:(?:[\w.\-]+ as ([\w.\-]+))|([\w.\-]+)),)*(?:(?:[\w.\-]+ as ([\w.\-]+))|([\w.\-]+))",
+                    option):
+                for result in mod:
+                    if len(result) > 0 and result != "*":
+                        yield result
+
+
+def regex_is_code_block(code: str) -> bool:
+    """
+        The regular expression based block classification that was
+        used before `testUtils.is_code_block`.
+    """
+    return re.fullmatch(
+        r"(?:(?:(?:from [\w.\-]+)?\s*import (?:(?:(?:(?: *[\w.\-]+(?: as [\w.\-]+)?),? *)+)|(?:\(\s*)(?:(?:(?: *[\w.\-]+(?: as [\w.\-]+)?),?\s*)+)(?:\s*\))|(?:\*))|(?:#[^\n]+)|(?:\"\"\"(?:.+)\"\"\")|(?:[A-Z][A-Z_\-]*\s*=\s*(?:\d+|(?:\"[^\"]+\")|(?:\'[^\']+\')|(?:\"\"\"[^(?:\"\"\")]+\"\"\"))))\s*)+",
+        code.strip()
+    )
+
+
+def generate_cells(count: int, rng: random.Random,
+                   multi_name_imports: bool = False) -> List[str]:
+    """
+        Generate code cells like the ones in data science notebooks:
+        import blocks, constants and code using the imports.
+        Cells importing several names next to a constant make the
+        regular expressions backtrack for minutes, so they are only
+        generated when `multi_name_imports` is set.
+    """
+    cells = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            amount = rng.randint(2, 6) if multi_name_imports else 1
+            names = ", ".join(f"name{i}_{k} as n{i}_{k}" for k in range(amount))
+            cells.append(f"from package{i}.module import {names}\nLIMIT_{i} = {i}")
+        elif kind < 0.3:
+            cells.append("\n".join(f"import module{i}_{k}" for k in range(rng.randint(1, 20))))
+        else:
+            lines = [
+                f"result_{k} = n{i}_{k}.compute(data[{k}], axis={k % 2})  # step {k}"
+                for k in range(rng.randint(5, 60))
+            ]
+            cells.append("\n".join(lines))
+    return cells
+
+
+def pathological_cells() -> List[str]:
+    """
+        Cells that make the regular expressions backtrack heavily.
+        The backtracking is exponential, so these are kept small.
+    """
+    return [
+        "import " + "a" * 5 + " " * 200 + "!",
+        "import " + "module, " * 3 + "(",
+        "from x import (" + "a as b, " * 4 + "\n" * 5,
+    ]
+
+
+class Timeout(Exception):
+    pass
+
+
+def raise_timeout(*args):
+    raise Timeout()
+
+
+def time_calls(func: Callable[[str], object], cells: List[str], repeat: int,
+               timeout: int) -> Optional[float]:
+    """
+        Time how long it takes to analyze all cells, best of `repeat` runs.
+        Returns None if a run takes longer than `timeout` seconds.
+    """
+    best = float('inf')
+    signal.signal(signal.SIGALRM, raise_timeout)
+    for _ in range(repeat):
+        # Measure parsing too, instead of hitting the cache of earlier runs
+        testUtils.parse_code.cache_clear()
+        signal.alarm(timeout)
+        try:
+            started = time.perf_counter()
+            for cell in cells:
+                result = func(cell)
+                if isinstance(result, Iterator):
+                    list(result)
+            best = min(best, time.perf_counter() - started)
+        except Timeout:
+            return None
+        finally:
+            signal.alarm(0)
+    return best
+
+
+def run(repeat: int, timeout: int) -> Dict[str, Dict[str, Optional[float]]]:
+    rng = random.Random(0)
+    workloads = {
+        'cells_100': generate_cells(100, rng),
+        'cells_1000': generate_cells(1000, rng),
+        'cells_5000': generate_cells(5000, rng),
+        'multi_name_imports_100': generate_cells(100, rng, multi_name_imports=True),
+        'pathological': pathological_cells(),
+    }
+    results = {}
+    for name, cells in workloads.items():
+        results[name] = {
+            'regex_find_imports': time_calls(regex_find_imported_modules, cells, repeat, timeout),
+            'ast_find_imports': time_calls(testUtils.find_imported_modules, cells, repeat, timeout),
+            'regex_is_code_block': time_calls(regex_is_code_block, cells, repeat, timeout),
+            'ast_is_code_block': time_calls(testUtils.is_code_block, cells, repeat, timeout),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement (default: %(default)s)")
+    parser.add_argument('--timeout', type=int, default=10,
+                        help="seconds before a measurement is given up, reported as null (default: %(default)s)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.repeat, args.timeout), indent=2))
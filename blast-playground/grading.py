@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import hashlib
+import unittest
+import importlib.util
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional
+
+import testUtils
+
+
+class TimedTestResult(unittest.TestResult):
+    """
+        Test result that records the outcome and duration of every test.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records: List[Dict[str, Any]] = []
+        self._started = 0.0
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+
+    def _record(self, test, outcome: str, message: Optional[str] = ''):
+        self.records.append({
+            'id': test.id(),
+            'name': test.id().split('.')[-1],
+            'outcome': outcome,
+            'time': time.perf_counter() - self._started,
+            'message': message,
+        })
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, 'passed')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, 'failed', str(err[1]))
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, 'error', f"{err[0].__name__}: {err[1]}")
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, 'skipped', reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, 'passed')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, 'failed', "Unexpected success")
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            outcome = 'failed' if issubclass(err[0], test.failureException) else 'error'
+            self._record(subtest, outcome, str(err[1]))
+
+
+class RecordingTestResult(TimedTestResult):
+    """
+        Test result that also stores the outcome of every test with the
+        hashes of the student files it used, see `testUtils.ResultsStore`.
+    """
+
+    def __init__(self, store: testUtils.ResultsStore):
+        super().__init__()
+        self.store = store
+        self._first_record = 0
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._first_record = len(self.records)
+        testUtils.start_recording()
+
+    def stopTest(self, test):
+        self.store.store(test.id(), testUtils.stop_recording(), self.records[self._first_record:])
+        super().stopTest(test)
+
+
+def iter_tests(suite: unittest.TestSuite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iter_tests(test)
+        else:
+            yield test
+
+
+def open_store(store_dir: str, test_file: str, source_dir: str) -> testUtils.ResultsStore:
+    """
+        Open the stored results of one submission. Results of another
+        version of the tests or of testUtils are not reused.
+    """
+    name = hashlib.sha256(source_dir.encode()).hexdigest()[:32]
+    version = f"{testUtils.file_hash(test_file)}:{testUtils.file_hash(testUtils.__file__)}"
+    return testUtils.ResultsStore(os.path.join(store_dir, f"{name}.json"), version)
+
+
+def grade_submission(test_file: str, source_dir: str,
+                     store_dir: Optional[str] = None,
+                     force: Optional[bool] = False) -> Dict[str, Any]:
+    """
+        Run the tests in `test_file` against one submission.
+        The test module is loaded fresh, with SOURCE_DIR pointing
+        to the submission.
+        With a `store_dir` the outcome of every test is stored, and
+        tests whose student files didn't change since the last run
+        reuse their stored outcome, unless `force` is set.
+    """
+    if os.path.dirname(test_file) not in sys.path:
+        sys.path.insert(0, os.path.dirname(test_file))
+    source_dir = os.path.join(os.path.abspath(source_dir), '')
+    os.environ['SOURCE_DIR'] = source_dir
+    testUtils.SOURCE_DIR = source_dir
+
+    started = time.perf_counter()
+    store = open_store(store_dir, test_file, source_dir) if store_dir else None
+    result = TimedTestResult() if store is None else RecordingTestResult(store)
+    reused: List[Dict[str, Any]] = []
+    order: Dict[str, int] = {}
+    try:
+        spec = importlib.util.spec_from_file_location('blast_tests', test_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        suite = unittest.defaultTestLoader.loadTestsFromModule(module)
+        order = {test.id(): i for i, test in enumerate(iter_tests(suite))}
+        if store is not None and not force:
+            remaining = unittest.TestSuite()
+            for test in iter_tests(suite):
+                outcome = store.lookup(test.id())
+                if outcome is None:
+                    remaining.addTest(test)
+                else:
+                    reused += [{**record, 'reused': True} for record in outcome]
+            suite = remaining
+        suite.run(result)
+    except Exception as e:
+        result.records.append({
+            'id': test_file, 'name': os.path.basename(test_file),
+            'outcome': 'error', 'time': 0.0,
+            'message': f"Could not load tests: {type(e).__name__}: {e}",
+        })
+
+    if store is not None:
+        store.save()
+
+    # Keep the order of the test file, subtests have ids like 'test_id (i=1)'
+    records = sorted(reused + result.records, key=lambda r: order.get(r['id'].split(' ')[0], len(order)))
+    return {
+        'name': os.path.basename(os.path.dirname(source_dir)),
+        'source_dir': source_dir,
+        'passed': sum(r['outcome'] == 'passed' for r in records),
+        'total': len(records),
+        'reused': len(reused),
+        'time': time.perf_counter() - started,
+        'tests': records,
+    }
+
+
+def to_junit(reports: List[Dict[str, Any]]) -> str:
+    """
+        Format grading reports as JUnit XML, one testsuite per submission.
+    """
+    suites = ET.Element('testsuites')
+    for report in reports:
+        suite = ET.SubElement(suites, 'testsuite', {
+            'name': report['name'],
+            'tests': str(report['total']),
+            'failures': str(sum(r['outcome'] == 'failed' for r in report['tests'])),
+            'errors': str(sum(r['outcome'] == 'error' for r in report['tests'])),
+            'skipped': str(sum(r['outcome'] == 'skipped' for r in report['tests'])),
+            'time': f"{report['time']:.3f}",
+        })
+        for record in report['tests']:
+            case = ET.SubElement(suite, 'testcase', {
+                'classname': record['id'].rsplit('.', 1)[0],
+                'name': record['name'],
+                'time': f"{record['time']:.3f}",
+            })
+            if record['outcome'] == 'failed':
+                ET.SubElement(case, 'failure', {'message': record['message']})
+            elif record['outcome'] == 'error':
+                ET.SubElement(case, 'error', {'message': record['message']})
+            elif record['outcome'] == 'skipped':
+                ET.SubElement(case, 'skipped', {'message': record['message']})
+    ET.indent(suites)
+    return ET.tostring(suites, encoding='unicode')
@@ -0,0 +1,105 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import testUtils
+from grading import TimedTestResult
+
+
+def find_notebooks(patterns: List[str]) -> List[str]:
+    """
+        Expand directories (searched recursively) and glob patterns
+        to a sorted list of notebooks. Jupyter checkpoints are skipped.
+    """
+    notebooks = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*.ipynb')
+        for path in glob.glob(pattern, recursive=True):
+            if path.endswith('.ipynb') and '.ipynb_checkpoints' not in path.split(os.sep):
+                notebooks.add(os.path.abspath(path))
+    return sorted(notebooks)
+
+
+def lint_notebook(path: str) -> Dict[str, Any]:
+    """
+        Run the checks of `testUtils.lint_jupyter_notebook` on one notebook.
+    """
+    testUtils.SOURCE_DIR = os.path.join(os.path.dirname(path), '')
+    file_name = os.path.basename(path)
+
+    @testUtils.lint_jupyter_notebook(file_name)
+    class Checks(unittest.TestCase):
+        pass
+
+    started = time.perf_counter()
+    result = TimedTestResult()
+    unittest.defaultTestLoader.loadTestsFromTestCase(Checks).run(result)
+
+    # The test names repeat the notebook name, e.g. test_jupyterNotebookRentIpynbBegintMetEenTitel
+    prefix = 'test_jupyterNotebook' + "".join(word.capitalize() for word in file_name.split('.'))
+    checks = [
+        {**record, 'name': record['name'].removeprefix(prefix)}
+        for record in result.records
+    ]
+    return {
+        'notebook': path,
+        'passed': sum(c['outcome'] == 'passed' for c in checks),
+        'total': len(checks),
+        'time': time.perf_counter() - started,
+        'checks': [{key: c[key] for key in ('name', 'outcome', 'time', 'message')} for c in checks],
+    }
+
+
+def lint_all(notebooks: List[str], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+        Lint notebooks on a process pool, results in the order of `notebooks`.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(notebooks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lint_notebook, notebooks, chunksize=chunksize))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run the Jupyter Notebook checks of testUtils on many notebooks in parallel."
+    )
+    parser.add_argument('notebooks', nargs='+',
+                        help="notebooks, directories to search for notebooks or glob patterns")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="report file, '-' for stdout (default: %(default)s)")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="write one JSON object per notebook per line")
+    args = parser.parse_args()
+
+    notebooks = find_notebooks(args.notebooks)
+    if not notebooks:
+        parser.error("no notebooks found")
+
+    started = time.perf_counter()
+    reports = lint_all(notebooks, args.workers)
+    print(f"Linted {len(reports)} notebooks in {time.perf_counter() - started:.2f}s, "
+          f"{sum(r['passed'] == r['total'] for r in reports)} passed every check", file=sys.stderr)
+
+    if args.jsonl:
+        report = "\n".join(json.dumps(r) for r in reports)
+    else:
+        report = json.dumps({
+            'time': time.perf_counter() - started,
+            'notebooks': reports,
+        }, indent=2)
+
+    if args.output == '-':
+        print(report)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as open_file:
+            open_file.write(report + "\n")
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import testUtils
+from grading import grade_submission, to_junit
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_json_report(report_file: str) -> List[Dict[str, Any]]:
+    """
+        Read the test records written by `--unittest` mode or by
+        the Jasmine JSON reporter.
+    """
+    with open(report_file, 'r', encoding='utf-8') as open_file:
+        return json.load(open_file)
+
+
+def parse_junit_report(report_file: str) -> List[Dict[str, Any]]:
+    """
+        Read the test records from a JUnit XML report, as written by PHPUnit.
+    """
+    records = []
+    for case in ET.parse(report_file).iter('testcase'):
+        outcome, message = 'passed', ''
+        for kind, name in (('failure', 'failed'), ('error', 'error'), ('skipped', 'skipped')):
+            element = case.find(kind)
+            if element is not None:
+                outcome = name
+                message = element.get('message') or (element.text or '').strip()
+                break
+        records.append({
+            'id': f"{case.get('class', case.get('classname', ''))}.{case.get('name')}",
+            'name': case.get('name'),
+            'outcome': outcome,
+            'time': float(case.get('time', 0)),
+            'message': message,
+        })
+    return records
+
+
+class Suite(NamedTuple):
+    """
+        A BLAST test suite. `command` may contain `{report}`, which
+        is replaced by the file the suite writes its results to.
+    """
+    command: List[str]
+    parse: Callable[[str], List[Dict[str, Any]]]
+    requires: List[str]     # files that have to exist to run the suite
+    env: Dict[str, str] = {}
+
+
+SUITES = {
+    'python': Suite(
+        [sys.executable, os.path.join(ROOT, 'run-all.py'), '--unittest', 'python-test.py', '{report}'],
+        parse_json_report, ['python-test.py'],
+    ),
+    'jupyter': Suite(
+        [sys.executable, os.path.join(ROOT, 'run-all.py'), '--unittest', 'jupyter-test.py', '{report}'],
+        parse_json_report, ['jupyter-test.py'],
+    ),
+    'javascript': Suite(
+        ['npm', 'run', 'test', '--',
+         f"--reporter={os.path.join(ROOT, 'tests', 'javascript', 'support', 'json-reporter.js')}"],
+        parse_json_report, ['package.json', 'node_modules'], {'BLAST_REPORT_FILE': '{report}'},
+    ),
+    'php': Suite(
+        ['composer', 'run', 'test', '--', '--log-junit', '{report}'],
+        parse_junit_report, ['composer.json', 'vendor'],
+    ),
+}
+
+
+def is_configured(suite: Suite) -> bool:
+    return (all(os.path.exists(os.path.join(ROOT, path)) for path in suite.requires)
+            and shutil.which(suite.command[0]) is not None)
+
+
+def run_suite(name: str, suite: Suite, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+        Run a suite as a subprocess and normalize its results.
+        The report has the same format as a submission in batch-grade.py.
+    """
+    with tempfile.TemporaryDirectory(prefix=f'blast-{name}-') as directory:
+        report_file = os.path.join(directory, 'report')
+        command = [part.replace('{report}', report_file) for part in suite.command]
+        env = {**os.environ, **{key: value.replace('{report}', report_file) for key, value in suite.env.items()}}
+
+        started = time.perf_counter()
+        try:
+            proc = subprocess.run(command, cwd=ROOT, env=env, capture_output=True,
+                                  text=True, errors='replace', timeout=timeout)
+            returncode, output = proc.returncode, proc.stdout + proc.stderr
+        except subprocess.TimeoutExpired:
+            returncode, output = None, f"Suite did not finish within {timeout} seconds"
+        except OSError as e:
+            returncode, output = None, f"Could not start suite: {e}"
+        elapsed = time.perf_counter() - started
+
+        try:
+            tests = suite.parse(report_file)
+        except (OSError, ValueError, ET.ParseError):
+            # The suite crashed before it could report its results
+            tests = [{'id': name, 'name': name, 'outcome': 'error', 'time': elapsed,
+                      'message': output.strip()[-2000:] or f"Suite exited with code {returncode}"}]
+
+    return {
+        'name': name,
+        'command': ' '.join(command),
+        'returncode': returncode,
+        'passed': sum(r['outcome'] == 'passed' for r in tests),
+        'total': len(tests),
+        'time': elapsed,
+        'tests': tests,
+    }
+
+
+def run_suites(names: List[str], timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+        Run suites concurrently. Results are returned in the order of `names`.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(names), 1)) as pool:
+        futures = [pool.submit(run_suite, name, SUITES[name], timeout) for name in names]
+        reports = []
+        for future in futures:
+            reports.append(future.result())
+            report = reports[-1]
+            print(f"{report['name']}: {report['passed']}/{report['total']} passed "
+                  f"({report['time']:.2f}s)", file=sys.stderr)
+    return reports
+
+
+def run_unittest(test_file: str, report_file: str) -> None:
+    """
+        Run a unittest file of this directory and write its test
+        records as JSON. Used by the Python suites.
+    """
+    report = grade_submission(os.path.join(ROOT, test_file), testUtils.SOURCE_DIR)
+    with open(report_file, 'w', encoding='utf-8') as open_file:
+        json.dump(report['tests'], open_file)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--unittest']:
+        run_unittest(*sys.argv[2:4])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(
+        description="Run the BLAST test suites concurrently and combine their results in one report."
+    )
+    parser.add_argument('suites', nargs='*', metavar='SUITE',
+                        help=f"suites to run: {', '.join(SUITES)} (default: all installed suites)")
+    parser.add_argument('-f', '--format', choices=['json', 'junit'], default='json',
+                        help="report format (default: %(default)s)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="report file, '-' for stdout (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="seconds after which a suite is stopped")
+    args = parser.parse_args()
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error(f"unknown suite '{name}', choose from {', '.join(SUITES)}")
+
+    names = args.suites or [name for name, suite in SUITES.items() if is_configured(suite)]
+    started = time.perf_counter()
+    reports = run_suites(names, args.timeout)
+
+    if args.format == 'junit':
+        report = to_junit(reports)
+    else:
+        report = json.dumps({
+            'time': time.perf_counter() - started,
+            'passed': sum(r['passed'] for r in reports),
+            'total': sum(r['total'] for r in reports),
+            'suites': reports,
+        }, indent=2)
+
+    if args.output == '-':
+        print(report)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as open_file:
+            open_file.write(report)
+
+    sys.exit(0 if all(r['passed'] + sum(t['outcome'] == 'skipped' for t in r['tests']) == r['total']
+                      for r in reports) else 1)
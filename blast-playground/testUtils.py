@@ -1,63 +1,1812 @@
 import os
+import sys
 import re
+import ast
+import asyncio
+import io
+import codecs
+import functools
 import json
+import keyword
+import math
+import tokenize
+import atexit
+import socket
+import hashlib
+import shlex
+import shutil
+import signal
+import selectors
+import tempfile
+import threading
+import time
 import unittest
 import subprocess
+from stat import S_ISDIR
 from typing import (
-    Any, Dict, Generator, List, Optional, Tuple, Union,
+    Any, Callable, Deque, Dict, FrozenSet, Generator, Iterable, List, NamedTuple,
+    Optional, Set, Tuple, Union,
 )
+from collections import deque
+from itertools import chain, zip_longest
+from multiprocessing.connection import Connection
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+try:
+    import black
+except ImportError:  # Falls back to the black command
+    black = None
 
 SOURCE_DIR = os.getenv('SOURCE_DIR', default='src/')
 PYTHON_COMMAND = "python3" # use command for your python 3.10+ version
 
-def run_formatter():
-    os.system('black -l 500 ' + SOURCE_DIR)
+# Default limits for student programs, None disables a limit
+TIMEOUT = 10                        # wall-clock seconds
+MAX_OUTPUT_SIZE = 10 * 1024 * 1024  # bytes written to stdout and stderr together
+CPU_LIMIT = None                    # CPU seconds (RLIMIT_CPU)
+MEMORY_LIMIT = None                 # bytes of address space (RLIMIT_AS)
+
+# Compiled student files, see `_code_cache_prefix`. Private to the current user
+CODE_CACHE_DIR = os.getenv('CODE_CACHE_DIR', default=os.path.join(
+    os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'blast-code-cache'))
+
+# Hashes of files formatted by `run_formatter`
+FORMATTER_CACHE = os.getenv('FORMATTER_CACHE', default='.format-cache.json')
+_FORMATTER_EXCLUDES = {'__pycache__', '__pypackages__', '_build', 'buck-out', 'build', 'dist', 'venv', 'node_modules'}
+
+# Shared warm interpreter, see `use_warm_interpreter`
+_warm_interpreter = None
+# Session-scoped results of `run_student_file`, see `use_result_cache`
+_result_cache: Optional[Dict[Tuple, Union[str, RuntimeError]]] = None
+# Files read by the current test, see `start_recording`
+_touched_files: Optional[Set[str]] = None
+
+class StudentTimeoutError(RuntimeError):
+    """
+        The student program didn't finish within the time limit.
+    """
+
+class LimitExceededError(RuntimeError):
+    """
+        The student program exceeded the output size, CPU or memory limit.
+    """
+
+def run_formatter(line_length: Optional[int] = 500) -> None:
+    """
+        Format the Python files in SOURCE_DIR with black.
+        Black runs in-process and only formats files whose contents
+        changed since the last run, the hashes of formatted files are
+        kept in FORMATTER_CACHE. Files are only read again when their
+        modification time or size changed. Without the black package
+        black is run as a command on the whole SOURCE_DIR.
+    """
+    if black is None:
+        os.system(f'black -l {line_length} ' + SOURCE_DIR)
+        return
+
+    settings = {'black': black.__version__, 'line_length': line_length, 'version': 2}
+    try:
+        with open(FORMATTER_CACHE, 'r', encoding='utf-8') as open_file:
+            cache = json.load(open_file)
+    except (OSError, ValueError):
+        cache = {}
+    if cache.get('settings') != settings:
+        cache = {'settings': settings, 'files': {}}
+    formatted_files = cache['files']
+
+    changed = False
+    for path in _find_python_files(SOURCE_DIR):
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = formatted_files.get(key)
+        if entry is not None and entry['stat'] == [stat.st_mtime_ns, stat.st_size]:
+            continue
+
+        with open(path, 'rb') as open_file:
+            data = open_file.read()
+        if entry is not None and entry['hash'] == hashlib.sha256(data).hexdigest():
+            # Touched but not changed, remember the new modification time
+            entry['stat'] = [stat.st_mtime_ns, stat.st_size]
+            changed = True
+            continue
+
+        mode = black.Mode(line_length=line_length, is_pyi=path.endswith('.pyi'))
+        try:
+            source, encoding, newline = _decode_source(data)
+            formatted = black.format_file_contents(source, fast=False, mode=mode)
+        except black.NothingChanged:
+            formatted = None
+        except Exception:
+            # Like black itself, leave files that can't be parsed alone
+            continue
+
+        if formatted is not None:
+            with open(path, 'w', encoding=encoding, newline=newline) as open_file:
+                open_file.write(formatted)
+            data = formatted.replace('\n', newline).encode(encoding)
+            stat = os.stat(path)
+        formatted_files[key] = {
+            'hash': hashlib.sha256(data).hexdigest(),
+            'stat': [stat.st_mtime_ns, stat.st_size],
+        }
+        changed = True
+
+    if changed:
+        tmp_path = f'{FORMATTER_CACHE}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as open_file:
+            json.dump(cache, open_file)
+        os.replace(tmp_path, FORMATTER_CACHE)
+
+def _decode_source(data: bytes) -> Tuple[str, str, str]:
+    """
+        Decode a Python file like black does, giving the source with
+        universal newlines, its encoding and the newline it used.
+        `black.decode_bytes` changed its signature between versions,
+        so only its stable formatting API is used.
+    """
+    buffer = io.BytesIO(data)
+    encoding, lines = tokenize.detect_encoding(buffer.readline)
+    if not lines:
+        return '', encoding, '\n'
+    newline = '\r\n' if lines[0][-2:] == b'\r\n' else '\n'
+    buffer.seek(0)
+    with io.TextIOWrapper(buffer, encoding) as text:
+        return text.read(), encoding, newline
+
+def _find_python_files(directory: str) -> Generator[str, None, None]:
+    """
+        Find the files black formats, skipping the directories
+        black excludes by default.
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d not in _FORMATTER_EXCLUDES)
+        for name in sorted(files):
+            if name.endswith(('.py', '.pyi')):
+                yield os.path.join(root, name)
+
+def file_hash(path: str) -> str:
+    """
+        Hash the contents of a file.
+    """
+    with open(path, 'rb') as open_file:
+        return hashlib.sha256(open_file.read()).hexdigest()
+
+def start_recording() -> None:
+    """
+        Start recording which student files are used, by
+        `run_student_file`, the notebook functions and friends.
+    """
+    global _touched_files
+    _touched_files = set()
+
+def stop_recording() -> Dict[str, Optional[str]]:
+    """
+        Stop recording and give the content hash of every file used
+        since `start_recording`, None for files that don't exist.
+    """
+    global _touched_files
+    touched, _touched_files = _touched_files or set(), None
+    return {path: _hash_if_exists(path) for path in sorted(touched)}
+
+def _touch(path: str, open_files: Optional[bool] = False,
+           imports: Optional[bool] = True) -> None:
+    """
+        Record that a test used a file. A program can import any module
+        in SOURCE_DIR or next to it, so it depends on all of those, and
+        on which modules there are. Programs that may open any file in
+        SOURCE_DIR depend on all files there.
+    """
+    if _touched_files is None:
+        return
+    _touched_files.add(os.path.abspath(path))
+    if not imports and not open_files:
+        return
+    for directory in {os.path.abspath(SOURCE_DIR), os.path.dirname(os.path.abspath(path))}:
+        suffix = '' if open_files and directory == os.path.abspath(SOURCE_DIR) else '.py'
+        # Stands for the list of files, so adding or removing a file is noticed
+        _touched_files.add(os.path.join(directory, f'*{suffix}'))
+        _touched_files.update(_list_files(directory, suffix))
+
+def _list_files(directory: str, suffix: str) -> List[str]:
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
+        files.extend(os.path.join(root, name) for name in names if name.endswith(suffix))
+    return sorted(files)
+
+def _hash_if_exists(path: str) -> Optional[str]:
+    directory, name = os.path.split(path)
+    if name.startswith('*'):
+        # Hash the names of the files matching the pattern, see `_touch`
+        return hashlib.sha256("\n".join(_list_files(directory, name[1:])).encode()).hexdigest()
+    try:
+        return file_hash(path)
+    except FileNotFoundError:
+        return None
+
+class ResultsStore:
+    """
+        Outcomes of tests, stored together with the hashes of the files
+        each test used. When none of those files changed, a test would
+        have the same outcome, so re-grading can reuse it.
+        Tests that didn't use any recorded file are never stored.
+    """
+
+    def __init__(self, path: str, version: Optional[str] = ''):
+        self.path = path
+        # Stored outcomes of another version of the tests are never reused
+        self.version = version
+        try:
+            with open(path, 'r', encoding='utf-8') as open_file:
+                stored = json.load(open_file)
+        except (OSError, ValueError):
+            stored = {}
+        self.entries: Dict[str, Any] = stored.get('tests', {}) if stored.get('version') == version else {}
+
+    def lookup(self, test_id: str) -> Optional[Any]:
+        """
+            Give the stored outcome of a test, if none of its files changed.
+        """
+        entry = self.entries.get(test_id)
+        if entry is None:
+            return None
+        if any(_hash_if_exists(path) != digest for path, digest in entry['files'].items()):
+            return None
+        return entry['outcome']
+
+    def store(self, test_id: str, files: Dict[str, Optional[str]], outcome: Any) -> None:
+        if files:
+            self.entries[test_id] = {'files': files, 'outcome': outcome}
+        else:
+            self.entries.pop(test_id, None)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as open_file:
+            json.dump({'version': self.version, 'tests': self.entries}, open_file)
+        os.replace(tmp_path, self.path)
+
+def use_result_cache(enabled: Optional[bool] = True) -> None:
+    """
+        Opt in to caching the results of `run_student_file` for the rest
+        of the test session. Calls with the same file contents, arguments,
+        seed and `open_files` flag then only run the student program once.
+        Pass `cache=False` to `run_student_file` for runs that rely on
+        side effects, such as programs writing files.
+    """
+    global _result_cache
+
+    if enabled and _result_cache is None:
+        _result_cache = {}
+    elif not enabled:
+        _result_cache = None
 
 def run_student_file(file_name: str, arguments: Optional[List[str]] = [],
                      seed: Optional[Union[int, None]] = None,
-                     open_files: Optional[bool] = False) -> str:
+                     open_files: Optional[bool] = False,
+                     cache: Optional[bool] = True,
+                     timeout: Optional[float] = None,
+                     max_output_size: Optional[int] = None,
+                     cpu_limit: Optional[int] = None,
+                     memory_limit: Optional[int] = None) -> str:
     """
         Run a file in a subprocess.
-        The function returns a string representation of
-        the stdout values from the subprocess.
+        The function returns the lowercased stdout of the subprocess.
+        After `use_result_cache()` earlier results are reused,
+        unless `cache` is False.
+
+        The limits default to TIMEOUT, MAX_OUTPUT_SIZE, CPU_LIMIT and
+        MEMORY_LIMIT. A program running too long raises StudentTimeoutError,
+        a program exceeding another limit raises LimitExceededError.
+    """
+    limits = _make_limits(timeout, max_output_size, cpu_limit, memory_limit)
+
+    path = _student_path(file_name)
+    _touch(path, open_files)
+    key = _result_cache_key(path, arguments, seed, open_files, limits) if cache else None
+    if key is None:
+        return _execute_student_file(file_name, arguments, seed, open_files, limits).output
+
+    if key not in _result_cache:
+        try:
+            _result_cache[key] = _execute_student_file(file_name, arguments, seed, open_files, limits).output
+        except RuntimeError as e:
+            _result_cache[key] = e
+
+    result = _result_cache[key]
+    if isinstance(result, RuntimeError):
+        raise type(result)(*result.args)
+    return result
+
+def _result_cache_key(path: str, arguments: List[str], seed: Optional[Union[int, None]],
+                      open_files: Optional[bool], limits: 'Limits') -> Optional[Tuple]:
+    if _result_cache is None or not os.path.isfile(path):
+        return None
+    return (os.path.abspath(path), file_hash(path), tuple(arguments), seed, bool(open_files), limits)
+
+async def run_student_file_async(file_name: str, arguments: Optional[List[str]] = [],
+                                 seed: Optional[Union[int, None]] = None,
+                                 open_files: Optional[bool] = False,
+                                 cache: Optional[bool] = True,
+                                 timeout: Optional[float] = None,
+                                 max_output_size: Optional[int] = None,
+                                 cpu_limit: Optional[int] = None,
+                                 memory_limit: Optional[int] = None) -> str:
+    """
+        Run a file in an asyncio subprocess, otherwise the same
+        as `run_student_file`.
+    """
+    limits = _make_limits(timeout, max_output_size, cpu_limit, memory_limit)
+
+    path = _student_path(file_name)
+    _touch(path, open_files)
+    key = _result_cache_key(path, arguments, seed, open_files, limits) if cache else None
+    if key is None:
+        return await _execute_student_file_async(file_name, arguments, seed, open_files, limits)
+
+    if key not in _result_cache:
+        try:
+            _result_cache[key] = await _execute_student_file_async(file_name, arguments, seed, open_files, limits)
+        except RuntimeError as e:
+            _result_cache[key] = e
+
+    result = _result_cache[key]
+    if isinstance(result, RuntimeError):
+        raise type(result)(*result.args)
+    return result
+
+async def run_student_file_cases_async(file_name: str,
+                                       cases: List[Tuple[List[str], Optional[int]]],
+                                       concurrency: Optional[int] = None,
+                                       return_exceptions: Optional[bool] = False,
+                                       **kwargs) -> List[Union[str, RuntimeError]]:
+    """
+        Run a file once for every (arguments, seed) case, at most
+        `concurrency` (default: the number of CPUs) at the same time.
+        The outputs are returned in the order of `cases`. The first
+        error is raised, unless `return_exceptions` is set: then errors
+        are returned in place of the output.
+        Other keyword arguments are passed to `run_student_file_async`.
+    """
+    semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+
+    async def run_case(arguments: List[str], seed: Optional[int]) -> str:
+        async with semaphore:
+            return await run_student_file_async(file_name, arguments, seed, **kwargs)
+
+    tasks = [asyncio.ensure_future(run_case(arguments, seed)) for arguments, seed in cases]
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+    finally:
+        # After the first error gather returns without waiting for the other
+        # cases, stop them before their programs outlive the event loop
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def run_student_file_cases(file_name: str,
+                           cases: List[Tuple[List[str], Optional[int]]],
+                           concurrency: Optional[int] = None,
+                           return_exceptions: Optional[bool] = False,
+                           **kwargs) -> List[Union[str, RuntimeError]]:
+    """
+        Run a file for many (arguments, seed) cases concurrently,
+        see `run_student_file_cases_async`. A test checking 50 seeds
+        then takes about as long as its slowest case:
+
+            outputs = testUtils.run_student_file_cases(
+                "dice.py", [([], seed) for seed in range(50)])
+    """
+    return asyncio.run(run_student_file_cases_async(
+        file_name, cases, concurrency, return_exceptions, **kwargs
+    ))
+
+def measure_student_file(file_name: str, arguments: Optional[List[str]] = [],
+                         seed: Optional[Union[int, None]] = None,
+                         open_files: Optional[bool] = False,
+                         timeout: Optional[float] = None,
+                         max_output_size: Optional[int] = None,
+                         cpu_limit: Optional[int] = None,
+                         memory_limit: Optional[int] = None) -> 'RunResult':
+    """
+        Run a file like `run_student_file` and measure its resource usage.
+        Results are never cached. `file_name` may also be an absolute
+        path, e.g. of a reference solution next to the tests.
+    """
+    limits = _make_limits(timeout, max_output_size, cpu_limit, memory_limit)
+    _touch(_student_path(file_name), open_files)
+    return _execute_student_file(file_name, arguments, seed, open_files, limits)
+
+class RunResult(NamedTuple):
+    """
+        Outcome and resource usage of a run of a student program.
+        Wall time includes interpreter startup, CPU times and peak
+        RSS are those of the student process only.
+    """
+    output: str         # lowercased stdout, as returned by `run_student_file`
+    returncode: int
+    wall_time: float    # seconds
+    user_time: float    # CPU seconds in user mode
+    sys_time: float     # CPU seconds in kernel mode
+    max_rss: int        # peak resident set size in bytes
+
+    @property
+    def cpu_time(self) -> float:
+        return self.user_time + self.sys_time
+
+def measure_scaling(file_name: str, make_arguments: Callable[[int], List[str]],
+                    sizes: List[int], repeat: Optional[int] = 3,
+                    **kwargs) -> Dict[int, RunResult]:
+    """
+        Measure a file at several input sizes. `make_arguments(size)`
+        gives the stdin lines for a size. Of `repeat` runs per size the
+        one using the least CPU time is kept, which filters out noise.
+        Other keyword arguments are passed to `measure_student_file`.
+    """
+    return {
+        size: min(
+            (measure_student_file(file_name, make_arguments(size), **kwargs) for _ in range(repeat)),
+            key=lambda result: result.cpu_time,
+        )
+        for size in sizes
+    }
+
+def assert_cost_within(file_name: str, reference_file: str,
+                       make_arguments: Callable[[int], List[str]],
+                       sizes: List[int], factor: Optional[float] = 3.0,
+                       metric: Optional[str] = 'cpu_time',
+                       slack: Optional[float] = None,
+                       repeat: Optional[int] = 3, **kwargs) -> None:
+    """
+        Assert that a student file costs at most `factor` times as much
+        as a reference solution, at every input size.
+        A relative `reference_file` is resolved against the directory
+        of the test file calling this function, not against SOURCE_DIR.
+        `metric` is an attribute of RunResult, e.g. 'cpu_time',
+        'wall_time' or 'max_rss'. `slack` is added to the allowed cost
+        so tiny inputs don't fail on noise, it defaults to 50 ms for
+        times and 4 MiB for memory.
+    """
+    if slack is None:
+        slack = 4 * 1024 * 1024 if metric == 'max_rss' else 0.05
+    test_file = sys._getframe(1).f_globals.get('__file__')
+    if test_file is not None:
+        reference_file = os.path.join(os.path.dirname(os.path.abspath(test_file)), reference_file)
+    student = measure_scaling(file_name, make_arguments, sizes, repeat, **kwargs)
+    reference = measure_scaling(os.path.abspath(reference_file), make_arguments, sizes, repeat, **kwargs)
+
+    rows = []
+    failed = False
+    for size in sizes:
+        cost, allowed = getattr(student[size], metric), getattr(reference[size], metric) * factor + slack
+        failed = failed or cost > allowed
+        rows.append(f"  size {size}: {cost:.6g} (reference {getattr(reference[size], metric):.6g}, allowed {allowed:.6g})")
+    if failed:
+        raise AssertionError(
+            f"Program uses more {metric} than {factor}x the reference solution\n" + "\n".join(rows)
+        )
+
+def _iter_lines(text: Union[str, Iterable[str]]) -> Generator[str, None, None]:
+    # Strings are split lazily, so huge outputs aren't copied into a list
+    for line in (io.StringIO(text) if isinstance(text, str) else text):
+        yield line.rstrip('\r\n')
+
+def _iter_items(text: Union[str, Iterable[str]], by: str,
+                ignore_case: bool, ignore_whitespace: bool) -> Generator[Tuple[int, str], None, None]:
+    """
+        Give the normalized lines or tokens of an output, each with
+        the number of the line it was found on.
+    """
+    for number, line in enumerate(_iter_lines(text), 1):
+        if ignore_case:
+            line = line.casefold()
+        if by == 'token':
+            for token in line.split():
+                yield number, token
+        elif ignore_whitespace:
+            yield number, " ".join(line.split())
+        else:
+            yield number, line
+
+def _is_close(a: str, b: str, float_tolerance: Optional[float]) -> bool:
+    if a == b:
+        return True
+    if float_tolerance is None:
+        return False
+    # Compare token by token, numbers may differ by `float_tolerance`
+    tokens_a, tokens_b = a.split(), b.split()
+    if len(tokens_a) != len(tokens_b):
+        return False
+    for token_a, token_b in zip(tokens_a, tokens_b):
+        if token_a == token_b:
+            continue
+        try:
+            if not math.isclose(float(token_a), float(token_b), rel_tol=float_tolerance, abs_tol=float_tolerance):
+                return False
+        except ValueError:
+            return False
+    return True
+
+def compare_output(output: Union[str, Iterable[str]], reference: Union[str, Iterable[str]],
+                   by: Optional[str] = 'line', ignore_case: Optional[bool] = True,
+                   ignore_whitespace: Optional[bool] = True,
+                   float_tolerance: Optional[float] = None,
+                   context: Optional[int] = 2) -> Optional[str]:
+    """
+        Compare output with a reference, item by item, and stop at the
+        first difference. Both can be strings or iterables of lines,
+        such as an open file or `StudentSession.lines()`, so neither
+        has to be in memory at once.
+
+        `by` is 'line' or 'token' (whitespace separated words).
+        With `ignore_whitespace`, runs of whitespace and trailing
+        empty lines don't matter. Numbers may differ by
+        `float_tolerance`, relative or absolute.
+
+        Returns None when the output matches, otherwise a compact
+        description of the first difference with `context` matching
+        items before it.
+    """
+    if by not in ('line', 'token'):
+        raise ValueError(f"Can't compare by '{by}', use 'line' or 'token'")
+    items = zip_longest(
+        _iter_items(output, by, ignore_case, ignore_whitespace),
+        _iter_items(reference, by, ignore_case, ignore_whitespace),
+    )
+    previous: Deque[Tuple[int, str]] = deque(maxlen=context)
+    for index, (actual, expected) in enumerate(items, 1):
+        if actual is not None and expected is not None and _is_close(actual[1], expected[1], float_tolerance):
+            previous.append(actual)
+            continue
+
+        # Empty lines at the end of either output don't count
+        if ignore_whitespace and by == 'line' and all(
+            (a is None or a[1] == "") and (e is None or e[1] == "")
+            for a, e in chain([(actual, expected)], items)
+        ):
+            return None
+
+        kind = 'token' if by == 'token' else 'line'
+        where = f"{kind} {index}" + (f" (line {(actual or expected)[0]})" if by == 'token' else "")
+        lines = [f"Output differs from the reference at {where}:"]
+        lines += [f"    {item}" for _, item in previous]
+        lines.append(f"  - expected: {expected[1]!r}" if expected is not None else "  - expected: end of output")
+        lines.append(f"  + got:      {actual[1]!r}" if actual is not None else "  + got:      end of output")
+        return "\n".join(lines)
+    return None
+
+def assert_output_matches(output: Union[str, Iterable[str]], reference: Union[str, Iterable[str]],
+                          **options) -> None:
+    """
+        Assert that output matches a reference, see `compare_output`
+        for the options. The failure message shows the first difference.
+    """
+    difference = compare_output(output, reference, **options)
+    if difference is not None:
+        raise AssertionError(difference)
+
+def _make_limits(timeout: Optional[float], max_output_size: Optional[int],
+                 cpu_limit: Optional[int], memory_limit: Optional[int]) -> 'Limits':
+    return Limits(
+        TIMEOUT if timeout is None else timeout,
+        MAX_OUTPUT_SIZE if max_output_size is None else max_output_size,
+        CPU_LIMIT if cpu_limit is None else cpu_limit,
+        MEMORY_LIMIT if memory_limit is None else memory_limit,
+    )
+
+def _student_path(file_name: str) -> str:
+    return file_name if os.path.isabs(file_name) else f'{SOURCE_DIR}{file_name}'
+
+def _rss_bytes(max_rss: int) -> int:
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+class Limits(NamedTuple):
+    """
+        Limits applied to a run of a student program.
+    """
+    timeout: Optional[float]
+    max_output_size: Optional[int]
+    cpu_limit: Optional[int]
+    memory_limit: Optional[int]
+
+def _set_resource_limits(limits: Limits) -> None:
+    """
+        Apply the CPU and memory limits to the current process.
+        Called in the child process, before the student program starts.
+    """
+    if resource is None:
+        return
+    if limits.cpu_limit is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_limit, limits.cpu_limit))
+    if limits.memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (limits.memory_limit, limits.memory_limit))
+
+def _limits_preexec_fn(limits: Limits) -> Optional[Callable[[], None]]:
+    """
+        Give the `preexec_fn` that applies `limits` in the child, or None
+        when there is nothing to apply. Without a `preexec_fn` the child
+        is started with the fast vfork path, which is also safe when
+        other threads are running.
+    """
+    if resource is None or (limits.cpu_limit is None and limits.memory_limit is None):
+        return None
+    return lambda: _set_resource_limits(limits)
+
+def _communicate(stdin_fd: int, stdout_fd: int, stderr_fd: int, input_data: bytes,
+                 limits: Limits, deadline: Optional[float],
+                 kill: Callable[[], None]) -> Tuple[bytes, bytes]:
+    """
+        Write `input_data` to stdin while reading stdout and stderr,
+        so a program never blocks on a full pipe. All three file
+        descriptors are closed afterwards. When the time or output
+        limit is exceeded, `kill` is called and an error is raised.
+    """
+    outputs: Dict[int, List[bytes]] = {stdout_fd: [], stderr_fd: []}
+    output_size = 0
+    offset = 0
+
+    selector = selectors.DefaultSelector()
+    try:
+        if input_data:
+            os.set_blocking(stdin_fd, False)
+            selector.register(stdin_fd, selectors.EVENT_WRITE)
+        else:
+            os.close(stdin_fd)
+        for fd in outputs:
+            selector.register(fd, selectors.EVENT_READ)
+
+        while selector.get_map():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                kill()
+                raise StudentTimeoutError(
+                    f"Program did not finish within {limits.timeout} seconds stdout [{_decode(b''.join(outputs[stdout_fd]))}]"
+                )
+
+            for key, _ in selector.select(remaining):
+                if key.fd == stdin_fd:
+                    try:
+                        offset += os.write(stdin_fd, input_data[offset:offset + 65536])
+                    except BrokenPipeError:
+                        # The program stopped reading, ignore the remaining input
+                        offset = len(input_data)
+                    if offset >= len(input_data):
+                        selector.unregister(stdin_fd)
+                        os.close(stdin_fd)
+                    continue
+
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fd)
+                    continue
+                outputs[key.fd].append(chunk)
+                output_size += len(chunk)
+                if limits.max_output_size is not None and output_size > limits.max_output_size:
+                    kill()
+                    raise LimitExceededError(
+                        f"Program wrote more than {limits.max_output_size} bytes of output stdout [{_decode(b''.join(outputs[stdout_fd]))[:1000]}]"
+                    )
+    finally:
+        for key in list(selector.get_map().values()):
+            os.close(key.fd)
+        selector.close()
+        for fd in outputs:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    return b"".join(outputs[stdout_fd]), b"".join(outputs[stderr_fd])
+
+def _decode(output: bytes) -> str:
+    return output.decode('utf-8', errors='replace')
+
+def _encode_arguments(arguments: List[str]) -> bytes:
+    return b"".join(argument.encode('utf-8') + b"\n" for argument in arguments)
+
+def _check_output(stdout: bytes, stderr: bytes, returncode: int, limits: Limits) -> str:
+    """
+        Give output - either an error or the terminal stdout.
+    """
+    if returncode in (-signal.SIGXCPU, -signal.SIGKILL) and limits.cpu_limit is not None:
+        raise LimitExceededError(
+            f"Program exceeded the CPU limit of {limits.cpu_limit} seconds stdout [{_decode(stdout)}]"
+        )
+    if len(stderr) > 0:
+        if limits.memory_limit is not None and stderr.rstrip().endswith(b"MemoryError"):
+            raise LimitExceededError(
+                f"Program exceeded the memory limit of {limits.memory_limit} bytes stdout [{_decode(stdout)}] stderr [{_decode(stderr)}]"
+            )
+        raise RuntimeError(
+            "Program encountered an error during runtime exit code [" + str(returncode) + "] stdout [" + _decode(stdout) + "] stderr [" + _decode(stderr) + "]"
+        )
+    return _decode(stdout).lower()
+
+def _wait_for_exit(pid: int, deadline: Optional[float]) -> Optional[Tuple[int, Any]]:
+    """
+        Wait for a child process with `os.wait4`, so its resource usage
+        is collected together with its exit status.
+        Returns None when the deadline passes first.
+    """
+    if deadline is not None:
+        remaining = max(deadline - time.monotonic(), 0)
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            # No pidfd (macOS, old Linux): kill the child at the deadline instead
+            timed_out = threading.Event()
+
+            def kill() -> None:
+                timed_out.set()
+                os.kill(pid, signal.SIGKILL)
+
+            timer = threading.Timer(remaining, kill)
+            timer.start()
+            try:
+                _, status, rusage = os.wait4(pid, 0)
+            finally:
+                timer.cancel()
+            return None if timed_out.is_set() else (status, rusage)
+
+        # A pidfd becomes readable once the child exits
+        with selectors.DefaultSelector() as selector:
+            selector.register(pidfd, selectors.EVENT_READ)
+            try:
+                exited = selector.select(remaining)
+            finally:
+                os.close(pidfd)
+        if not exited:
+            return None
+
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage
+
+def _student_command(file_name: str, seed: Optional[Union[int, None]],
+                     open_files: Optional[bool]) -> List[str]:
+    """
+        Build the command that runs a student file.
     """
-    cmd = f'{PYTHON_COMMAND} '
+    args = shlex.split(PYTHON_COMMAND)
 
     if seed is not None or open_files:
-        cmd += f"-c \"fopen=open;"
+        cmd = "fopen=open\n"
         # Execute the file with a set `random` seed
         if seed is not None:
-            cmd += f"import random;random.seed({seed});"
+            cmd += f"import random;random.seed({seed!r})\n"
         # Make sure the function `open` refers to SOURCE_DIR
         if open_files:
-            cmd += f"open=(lambda fname, *args, **kwargs: fopen('{SOURCE_DIR}'+fname, *args, **kwargs));"
-        cmd += f"exec(fopen('{SOURCE_DIR}{file_name}').read())\""
+            cmd += f"open=(lambda fname, *args, **kwargs: fopen({SOURCE_DIR!r}+fname, *args, **kwargs))\n"
+        path = _student_path(file_name)
+        cmd += _LOAD_CODE + f"exec(_load_code({path!r}, {_code_cache_prefix(path)!r}))"
+        args += ["-c", cmd]
     else:
-        cmd += f"{SOURCE_DIR}{file_name}"
+        args.append(_student_path(file_name))
+    return args
+
+def _execute_student_file(file_name: str, arguments: List[str],
+                          seed: Optional[Union[int, None]],
+                          open_files: Optional[bool],
+                          limits: Limits) -> RunResult:
+    """
+        Run a file in a subprocess, see `run_student_file`.
+        After `use_warm_interpreter()` the file runs in a child
+        forked from a warm interpreter instead.
+    """
+    if _warm_interpreter is not None:
+        return _warm_interpreter.run(file_name, arguments, seed, open_files, limits)
+
+    args = _student_command(file_name, seed, open_files)
 
     # Start the process
-    proc = subprocess.Popen(cmd,
-                            shell=True, stdout=subprocess.PIPE,
-                            stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdin_r, stdin_w = os.pipe()
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    started = time.monotonic()
+    deadline = None if limits.timeout is None else started + limits.timeout
+    try:
+        proc = subprocess.Popen(args, stdin=stdin_r, stdout=stdout_w, stderr=stderr_w,
+                                preexec_fn=_limits_preexec_fn(limits))
+    except BaseException:
+        for fd in (stdin_w, stdout_r, stderr_r):
+            os.close(fd)
+        raise
+    finally:
+        for fd in (stdin_r, stdout_w, stderr_w):
+            os.close(fd)
 
-    for argument in arguments:
-        proc.stdin.write(argument.encode('ascii') + b"\n")
-        proc.stdin.flush()
-    
-    proc.stdin.close()
+    try:
+        stdout, stderr = _communicate(stdin_w, stdout_r, stderr_r, _encode_arguments(arguments),
+                                      limits, deadline, proc.kill)
+        exited = _wait_for_exit(proc.pid, deadline)
+        if exited is None:
+            raise StudentTimeoutError(
+                f"Program did not finish within {limits.timeout} seconds stdout [{_decode(stdout)}]"
+            )
+        wall_time = time.monotonic() - started
+        status, rusage = exited
+        # The process has been reaped by `os.wait4`, let Popen know
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        proc.kill()
+        proc.wait()
 
-    proc.wait()
+    return RunResult(
+        _check_output(stdout, stderr, proc.returncode, limits), proc.returncode, wall_time,
+        rusage.ru_utime, rusage.ru_stime, _rss_bytes(rusage.ru_maxrss),
+    )
 
-    stderr = proc.stderr.read()
-    proc.stderr.close()
-    # Give output - either an error or the terminal stdout
-    if len(stderr) > 0:
-        raise RuntimeError(
-            "Program encountered an error during runtime exit code [" + str(proc.returncode) + "] stdout [" + str(proc.stdout.read()) + "] stderr [" + str(stderr) + "]"
+async def _execute_student_file_async(file_name: str, arguments: List[str],
+                                      seed: Optional[Union[int, None]],
+                                      open_files: Optional[bool],
+                                      limits: Limits) -> str:
+    """
+        Run a file in an asyncio subprocess, see `run_student_file_async`.
+        The warm interpreter is used from a thread.
+    """
+    if _warm_interpreter is not None:
+        result = await asyncio.to_thread(_warm_interpreter.run, file_name, arguments, seed, open_files, limits)
+        return result.output
+
+    proc = await asyncio.create_subprocess_exec(
+        *_student_command(file_name, seed, open_files),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        preexec_fn=_limits_preexec_fn(limits),
+    )
+    stdout: List[bytes] = []
+    stderr: List[bytes] = []
+    output_size = 0
+
+    async def write(data: bytes) -> None:
+        try:
+            proc.stdin.write(data)
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The program stopped reading, ignore the remaining input
+            pass
+        finally:
+            proc.stdin.close()
+
+    async def read(stream: asyncio.StreamReader, chunks: List[bytes]) -> None:
+        nonlocal output_size
+        while chunk := await stream.read(65536):
+            chunks.append(chunk)
+            output_size += len(chunk)
+            if limits.max_output_size is not None and output_size > limits.max_output_size:
+                raise LimitExceededError(
+                    f"Program wrote more than {limits.max_output_size} bytes of output stdout [{_decode(b''.join(stdout))[:1000]}]"
+                )
+
+    communicate = asyncio.gather(
+        write(_encode_arguments(arguments)), read(proc.stdout, stdout), read(proc.stderr, stderr), proc.wait(),
+    )
+    try:
+        await asyncio.wait_for(communicate, limits.timeout)
+    except asyncio.TimeoutError:
+        raise StudentTimeoutError(
+            f"Program did not finish within {limits.timeout} seconds stdout [{_decode(b''.join(stdout))}]"
         )
-    stdout = proc.stdout.read()
-    proc.stdout.close()
-    return str(stdout).lower()
+    finally:
+        if communicate.done() and not communicate.cancelled():
+            # A cancelled run leaves its error unretrieved, which asyncio would log
+            communicate.exception()
+        # The writer may have been cancelled before it started, and proc.wait()
+        # only returns once every pipe is closed. The wait is shielded so that
+        # cancelling the cleanup doesn't leave the program running.
+        proc.stdin.close()
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        await asyncio.shield(proc.wait())
+
+    return _check_output(b''.join(stdout), b''.join(stderr), proc.returncode, limits)
+
+class StudentSession:
+    """
+        An interactive run of a student program. Instead of passing
+        all input up front, a test reads the output up to a prompt,
+        sends a line and checks the response, in a single process:
+
+            with testUtils.StudentSession("guess.py", seed=1) as session:
+                session.expect("guess a number")
+                session.send_line("50")
+                session.expect("too high")
+
+        Every step is bound by `timeout`, the other limits apply to
+        the whole session.
+    """
+
+    def __init__(self, file_name: str, seed: Optional[Union[int, None]] = None,
+                 open_files: Optional[bool] = False,
+                 timeout: Optional[float] = None,
+                 max_output_size: Optional[int] = None,
+                 cpu_limit: Optional[int] = None,
+                 memory_limit: Optional[int] = None):
+        self.limits = _make_limits(timeout, max_output_size, cpu_limit, memory_limit)
+        _touch(_student_path(file_name), open_files)
+        self.output = ""    # everything written to stdout so far
+        self.stderr = ""
+        self.before = ""    # output skipped by the last `expect`
+        self._buffer = ""   # output not consumed by `expect` yet
+        self._output_size = 0
+        self._decoders = {}
+
+        # Prompts have to reach the test before the program blocks on input
+        env = {**os.environ, 'PYTHONUNBUFFERED': '1'}
+        self.proc = subprocess.Popen(
+            _student_command(file_name, seed, open_files),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            preexec_fn=_limits_preexec_fn(self.limits),
+        )
+        self._selector = selectors.DefaultSelector()
+        for pipe in (self.proc.stdout, self.proc.stderr):
+            os.set_blocking(pipe.fileno(), False)
+            self._selector.register(pipe, selectors.EVENT_READ)
+            self._decoders[pipe] = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read(self, deadline: Optional[float]) -> bool:
+        """
+            Wait until output is available and read it.
+            Returns False once the program closed stdout and stderr.
+        """
+        if not self._selector.get_map():
+            return False
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        for key, _ in self._selector.select(remaining):
+            chunk = os.read(key.fd, 65536)
+            decoder = self._decoders[key.fileobj]
+            text = decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                self._selector.unregister(key.fileobj)
+            self._output_size += len(chunk)
+            if self.limits.max_output_size is not None and self._output_size > self.limits.max_output_size:
+                self.close()
+                raise LimitExceededError(
+                    f"Program wrote more than {self.limits.max_output_size} bytes of output stdout [{self.output[:1000]}]"
+                )
+            if key.fileobj is self.proc.stderr:
+                self.stderr += text
+            else:
+                self.output += text
+                self._buffer += text
+        return True
+
+    def _deadline(self, timeout: Optional[float]) -> Optional[float]:
+        timeout = self.limits.timeout if timeout is None else timeout
+        return None if timeout is None else time.monotonic() + timeout
+
+    def expect(self, pattern: Union[str, re.Pattern],
+               timeout: Optional[float] = None) -> re.Match:
+        """
+            Read output until it matches `pattern`, a regular expression
+            that ignores case unless it is compiled. The output up to the
+            end of the match is consumed, the skipped output is kept in
+            `before`. Returns the match.
+        """
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern, re.IGNORECASE)
+        deadline = self._deadline(timeout)
+
+        while True:
+            match = pattern.search(self._buffer)
+            if match is not None:
+                self.before = self._buffer[:match.start()]
+                self._buffer = self._buffer[match.end():]
+                return match
+            if deadline is not None and time.monotonic() >= deadline:
+                self.close()
+                raise StudentTimeoutError(
+                    f"Program did not print {pattern.pattern!r} within {self.limits.timeout if timeout is None else timeout} seconds stdout [{self._buffer}]"
+                )
+            if not self._read(deadline):
+                self._raise_error()
+                raise AssertionError(
+                    f"Program ended without printing {pattern.pattern!r} stdout [{self._buffer}]"
+                )
+
+    def send_line(self, line: str) -> None:
+        """
+            Send a line of input to the program.
+        """
+        try:
+            self.proc.stdin.write(line.encode('utf-8') + b"\n")
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            self._wait(self._deadline(None))
+            self._raise_error()
+            raise AssertionError(
+                f"Program ended before reading {line!r} stdout [{self._buffer}]"
+            )
+
+    def read_rest(self, timeout: Optional[float] = None) -> str:
+        """
+            Close stdin, wait for the program to end and give the
+            output that hasn't been consumed by `expect`, lowercased
+            like the output of `run_student_file`.
+        """
+        if not self.proc.stdin.closed:
+            self.proc.stdin.close()
+        self._wait(self._deadline(timeout))
+        self._raise_error()
+        rest, self._buffer = self._buffer, ""
+        return rest.lower()
+
+    def lines(self, timeout: Optional[float] = None) -> Generator[str, None, None]:
+        """
+            Give the output that hasn't been consumed yet, line by line,
+            while the program is still running. `timeout` applies to
+            every line. Errors are raised once the output ends.
+        """
+        deadline = self._deadline(timeout)
+        while True:
+            end = self._buffer.find("\n")
+            if end >= 0:
+                line, self._buffer = self._buffer[:end + 1], self._buffer[end + 1:]
+                yield line
+                deadline = self._deadline(timeout)
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                self.close()
+                raise StudentTimeoutError(
+                    f"Program did not print a line within {self.limits.timeout if timeout is None else timeout} seconds stdout [{self._buffer}]"
+                )
+            if not self._read(deadline):
+                self._raise_error()
+                if self._buffer:
+                    line, self._buffer = self._buffer, ""
+                    yield line
+                return
+
+    def _wait(self, deadline: Optional[float]) -> None:
+        while self._read(deadline):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            self.proc.wait(remaining)
+        except subprocess.TimeoutExpired:
+            self.close()
+            raise StudentTimeoutError(
+                f"Program did not finish within {self.limits.timeout} seconds stdout [{self.output}]"
+            )
+
+    def _raise_error(self) -> None:
+        """
+            Raise the error of a program that has ended, like `run_student_file`.
+        """
+        if self.proc.poll() is None:
+            self._wait(self._deadline(None))
+        _check_output(self.output.encode('utf-8'), self.stderr.encode('utf-8'), self.proc.returncode, self.limits)
+
+    def close(self) -> None:
+        """
+            Stop the program if it is still running.
+        """
+        if self.proc.stdout.closed:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self._selector.close()
+        for pipe in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+# Hashes of student files by path, modification time and size, see `_code_cache_prefix`
+_code_cache_keys: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+def _private_code_cache_dir() -> Optional[str]:
+    """
+        Create CODE_CACHE_DIR, accessible to the current user only.
+        Cached code objects are executed without further checks, so
+        the cache is not used when the directory belongs to another
+        user or other users can write to it.
+    """
+    try:
+        os.makedirs(CODE_CACHE_DIR, mode=0o700, exist_ok=True)
+        stat = os.lstat(CODE_CACHE_DIR)
+    except OSError:
+        return None
+    if not S_ISDIR(stat.st_mode) or stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        return None
+    return CODE_CACHE_DIR
+
+def _code_cache_prefix(path: str) -> Optional[str]:
+    """
+        Give the path of the cached code object of a student file,
+        without the suffix naming the Python version. The key is the
+        hash of the contents of the file and its path, since the path
+        ends up in tracebacks. Returns None when there is no cache.
+    """
+    cache_dir = _private_code_cache_dir()
+    if cache_dir is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _code_cache_keys.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, 'rb') as open_file:
+            digest = hashlib.sha256(path.encode() + b'\0' + open_file.read()).hexdigest()
+        cached = _code_cache_keys[path] = (key, digest)
+    return os.path.join(cache_dir, f'{cached[1]}.')
+
+# Loads the code object of a student file, compiling it only when it isn't
+# cached yet for this interpreter. Shared by the `-c` bootstrap and the warm
+# interpreter, it removes itself so the student program doesn't see it.
+_LOAD_CODE = r'''
+def _load_code(path, cache):
+    import os, sys, marshal
+    globals().pop("_load_code", None)
+    if cache is not None:
+        cache += f"{sys.implementation.cache_tag}-{sys.hexversion:x}"
+        try:
+            with fopen(cache, "rb") as cached:
+                return marshal.load(cached)
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    with fopen(path, "rb") as source:
+        code = compile(source.read(), path, "exec")
+    if cache is not None:
+        try:
+            with fopen(f"{cache}.{os.getpid()}.tmp", "wb") as cached:
+                marshal.dump(code, cached)
+            os.replace(f"{cache}.{os.getpid()}.tmp", cache)
+        except OSError:
+            pass
+    return code
+'''
+
+# Runs inside the warm interpreter. Every request is handled by a forked
+# handler, which forks the student program and reports its exit status.
+_WARM_SERVER_CODE = r'''
+import os, sys, gc, json, socket, signal, traceback, types
+import atexit, random, selectors, shutil, threading
+
+load_code = _load_code
+
+def set_resource_limits(request):
+    import resource
+    if request["cpu_limit"] is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (request["cpu_limit"],) * 2)
+    if request["memory_limit"] is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (request["memory_limit"],) * 2)
+
+def finalize(main):
+    # os._exit skips the shutdown of a normal interpreter, so do its steps:
+    # join non-daemon threads, run exit handlers, drop the globals (closing
+    # and flushing files the program left open) and flush the standard streams
+    threading._shutdown()
+    atexit._run_exitfuncs()
+    main.__dict__.clear()
+    gc.collect()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+
+def run_student(request, fds):
+    set_resource_limits(request)
+    # Only exit handlers registered by the student program run on exit
+    atexit._clear()
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request["cwd"])
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False)
+
+    path = request["path"]
+    main = types.ModuleType("__main__")
+    main.__file__ = path
+    main.__builtins__ = __builtins__
+    sys.modules["__main__"] = main
+    if request["bootstrap"]:
+        sys.argv, sys.path[0] = ["-c"], ""
+        main.fopen = open
+    else:
+        sys.argv, sys.path[0] = [path], os.path.dirname(os.path.abspath(path))
+
+    # Children share the state of the warm interpreter, so always reseed
+    random.seed(request["seed"])
+    if request["seed"] is not None:
+        main.random = random
+    if request["open_files"]:
+        source_dir = request["source_dir"]
+        main.open = lambda fname, *args, **kwargs: open(source_dir + fname, *args, **kwargs)
+
+    code = 0
+    try:
+        exec(load_code(path, request["code_cache"]), main.__dict__)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException as e:
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        code = 1
+    try:
+        finalize(main)
+    finally:
+        os._exit(code)
+
+def handle(conn):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    message, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+    request = json.loads(message)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        run_student(request, fds)
+    for fd in fds:
+        os.close(fd)
+    conn.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+    _, status, rusage = os.wait4(pid, 0)
+    reply = {
+        "returncode": os.waitstatus_to_exitcode(status),
+        "user_time": rusage.ru_utime,
+        "sys_time": rusage.ru_stime,
+        "max_rss": rusage.ru_maxrss,
+    }
+    try:
+        conn.sendall(json.dumps(reply).encode() + b"\n")
+    except OSError:
+        # The client stopped waiting, e.g. after killing the program
+        pass
+    os._exit(0)
+
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(sys.argv[1])
+server.listen(64)
+signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+# The parent holds the other end of stdin, EOF means it is gone,
+# even when it never got to stop this interpreter
+selector = selectors.DefaultSelector()
+selector.register(server, selectors.EVENT_READ)
+selector.register(0, selectors.EVENT_READ)
+print("ready", flush=True)
+while True:
+    for key, _ in selector.select():
+        if key.fileobj == 0:
+            if not os.read(0, 1 << 16):
+                shutil.rmtree(os.path.dirname(sys.argv[1]), ignore_errors=True)
+                os._exit(0)
+            continue
+        conn, _ = server.accept()
+        if os.fork() == 0:
+            selector.close()
+            server.close()
+            handle(conn)
+        conn.close()
+'''
+
+
+class WarmInterpreter:
+    """
+        A Python interpreter that is started once and forks
+        a fresh child for every student program, so interpreter
+        startup is no longer paid for each run.
+        Student programs are isolated from each other the same way
+        forked processes are: every run starts from the clean state
+        of the warm interpreter.
+    """
+
+    def __init__(self):
+        self.proc = None
+        self.socket_dir = None
+
+    def start(self) -> None:
+        """
+            Start the warm interpreter and wait until it accepts requests.
+        """
+        if self.proc is not None:
+            return
+        self.socket_dir = tempfile.mkdtemp(prefix='blast-warm-')
+        self.proc = subprocess.Popen(
+            shlex.split(PYTHON_COMMAND) + ['-c', 'fopen = open\n' + _LOAD_CODE + _WARM_SERVER_CODE, self.socket_path()],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        if self.proc.stdout.readline().strip() != b'ready':
+            self.close()
+            raise RuntimeError("Could not start warm interpreter")
+
+    def socket_path(self) -> str:
+        return os.path.join(self.socket_dir, 'warm.sock')
+
+    def close(self) -> None:
+        """
+            Stop the warm interpreter.
+        """
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc.stdin.close()
+            self.proc.stdout.close()
+            self.proc = None
+        if self.socket_dir is not None:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+            self.socket_dir = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, file_name: str, arguments: Optional[List[str]] = [],
+            seed: Optional[Union[int, None]] = None,
+            open_files: Optional[bool] = False,
+            limits: Optional[Limits] = None) -> RunResult:
+        """
+            Run a file in a child of the warm interpreter.
+            Behaves the same as `measure_student_file`.
+        """
+        self.start()
+        limits = limits or Limits(TIMEOUT, MAX_OUTPUT_SIZE, CPU_LIMIT, MEMORY_LIMIT)
+        request = {
+            'path': _student_path(file_name),
+            'cwd': os.getcwd(),
+            'seed': seed,
+            'open_files': bool(open_files),
+            'source_dir': SOURCE_DIR,
+            # Mimic the `-c` bootstrap used by `run_student_file`
+            'bootstrap': seed is not None or bool(open_files),
+            'code_cache': _code_cache_prefix(_student_path(file_name)),
+            'cpu_limit': limits.cpu_limit,
+            'memory_limit': limits.memory_limit,
+        }
+        started = time.monotonic()
+        deadline = None if limits.timeout is None else started + limits.timeout
+
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            try:
+                conn.connect(self.socket_path())
+                socket.send_fds(conn, [json.dumps(request).encode()],
+                                [stdin_r, stdout_w, stderr_w])
+            except BaseException:
+                for fd in (stdin_w, stdout_r, stderr_r):
+                    os.close(fd)
+                raise
+            finally:
+                for fd in (stdin_r, stdout_w, stderr_w):
+                    os.close(fd)
+
+            replies = conn.makefile('rb')
+            line = replies.readline()
+            if not line:
+                raise RuntimeError("Warm interpreter stopped before starting the program")
+            pid = json.loads(line)['pid']
+
+            def kill():
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+            stdout, stderr = _communicate(stdin_w, stdout_r, stderr_r, _encode_arguments(arguments),
+                                          limits, deadline, kill)
+            # A timeout of 0 would make the socket non-blocking, so check the deadline first
+            remaining = None if deadline is None else deadline - time.monotonic()
+            line, timed_out = b'', remaining is not None and remaining <= 0
+            if not timed_out:
+                conn.settimeout(remaining)
+                try:
+                    line = replies.readline()
+                except (socket.timeout, TimeoutError):
+                    timed_out = True
+            if not line:
+                kill()
+                if timed_out:
+                    raise StudentTimeoutError(
+                        f"Program did not finish within {limits.timeout} seconds stdout [{_decode(stdout)}]"
+                    )
+                # The handler died without reporting the exit status
+                raise RuntimeError(f"Warm interpreter stopped before the program finished stdout [{_decode(stdout)}]")
+            reply = json.loads(line)
+            wall_time = time.monotonic() - started
+
+        return RunResult(
+            _check_output(stdout, stderr, reply['returncode'], limits), reply['returncode'], wall_time,
+            reply['user_time'], reply['sys_time'], _rss_bytes(reply['max_rss']),
+        )
+
+
+def use_warm_interpreter(enabled: Optional[bool] = True) -> None:
+    """
+        Opt in to running student files through a shared warm interpreter.
+        Every call to `run_student_file` then forks a child from an
+        interpreter that has already started up.
+    """
+    global _warm_interpreter
+
+    if enabled and _warm_interpreter is None:
+        _warm_interpreter = WarmInterpreter()
+        _warm_interpreter.start()
+        atexit.register(_warm_interpreter.close)
+    elif not enabled and _warm_interpreter is not None:
+        _warm_interpreter.close()
+        _warm_interpreter = None
+
+# Analyzed notebooks, keyed by path, see `load_notebook_model`
+_notebook_models: Dict[str, Tuple[Tuple[int, int], 'NotebookModel']] = {}
+
+def get_source(cell: Dict[str, Any]) -> str:
+    """
+        Get the source of a notebook cell as a single string.
+    """
+    return (cell['source']
+            if cell['source'].__class__.__name__ == 'str'
+            else "".join(cell['source'])
+            )
+
+class NotebookModel:
+    """
+        A Jupyter Notebook analyzed once for all checks of
+        `lint_jupyter_notebook`: the raw JSON, the normalized
+        source of every cell, the header tree and the imported
+        modules with the headers they are used under.
+    """
+
+    def __init__(self, notebook: Dict[str, Any]):
+        self.notebook = notebook
+
+        # A malformed notebook fails every check except the format check,
+        # which reports what is missing.
+        self.error: Optional[Exception] = None
+        self.types: List[str] = []
+        self.sources: List[str] = []
+        try:
+            for cell in notebook['cells']:
+                self.types.append(cell['cell_type'])
+                self.sources.append(get_source(cell))
+        except Exception as e:
+            self.error = e
+            self.types, self.sources = [], []
+
+        self.markdown = [
+            source for cell_type, source in zip(self.types, self.sources)
+            if cell_type == 'markdown'
+        ]
+
+        # Problems found while collecting imports are only reported
+        # by the test that checks the imports.
+        self.import_error: Optional[Exception] = None
+        try:
+            self.headers, self.modules = open_notebook(zip(self.types, self.sources))
+        except Exception as e:
+            self.headers, self.modules = [], []
+            self.import_error = e
+        browse_for_used_imports(self.headers, self.modules)
+        self.document = nest_document(self.headers)
+        self.placement = place_imports(self.document, self.modules)
+
+def load_notebook_model(path: str) -> NotebookModel:
+    """
+        Load and analyze a Jupyter Notebook. The analysis is reused
+        for as long as the modification time and size of the file
+        stay the same.
+    """
+    # The notebook is only analyzed, not run
+    _touch(path, imports=False)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _notebook_models.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(path, 'r', encoding='utf-8') as open_file:
+        model = NotebookModel(json.load(open_file))
+    _notebook_models[path] = (key, model)
+    return model
+
+# Runs inside the notebook kernel. Requests and replies are JSON messages
+# sent over a socket, cell output is captured per cell. The kernel runs student
+# code, so its replies are never unpickled: values are sent as their repr.
+_NOTEBOOK_KERNEL_CODE = r'''
+import ast, io, sys, json, time, linecache, traceback, contextlib
+from multiprocessing.connection import Connection
+
+conn = Connection(int(sys.argv[1]))
+sys.argv = [""]
+namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+
+def strip_magics(source):
+    # IPython magics and shell commands can't run without IPython
+    return "".join(
+        "\n" if line.lstrip().startswith(("%", "!")) else line
+        for line in source.splitlines(True)
+    )
+
+def format_error(e):
+    # Skip the frame of the kernel itself
+    lines = traceback.format_exception(type(e), e, e.__traceback__.tb_next)
+    return {"type": type(e).__name__, "message": str(e), "traceback": "".join(lines)}
+
+def run_cell(source, filename):
+    source = strip_magics(source)
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    stdout, stderr = io.StringIO(), io.StringIO()
+    result = error = None
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            tree = ast.parse(source, filename)
+            last = None
+            # Like Jupyter, show the value of a trailing expression
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                last = ast.Expression(tree.body.pop().value)
+            exec(compile(tree, filename, "exec"), namespace)
+            if last is not None:
+                value = eval(compile(last, filename, "eval"), namespace)
+                if value is not None:
+                    namespace["_"] = value
+                    result = repr(value)
+        except BaseException as e:
+            error = format_error(e)
+    return {
+        "stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "result": result,
+        "error": error, "time": time.perf_counter() - started,
+    }
+
+def evaluate(expression):
+    try:
+        value = eval(expression, namespace)
+    except BaseException as e:
+        return "error", format_error(e)
+    try:
+        return "ok", repr(value)
+    except BaseException as e:
+        return "error", format_error(e)
+
+while True:
+    try:
+        request = json.loads(conn.recv_bytes())
+    except EOFError:
+        break
+    if request[0] == "run":
+        reply = run_cell(*request[1:])
+    elif request[0] == "eval":
+        reply = evaluate(request[1])
+    conn.send_bytes(json.dumps(reply).encode())
+'''
+
+class CellResult(NamedTuple):
+    """
+        Outcome of running a single code cell of a notebook.
+    """
+    index: int              # position of the cell in the notebook
+    source: str
+    stdout: str
+    stderr: str
+    result: Optional[str]   # repr of the value of a trailing expression
+    error: Optional[Dict[str, str]]  # type, message and traceback of an exception
+    time: float             # seconds
+
+def _is_error_reply(error: Any, optional: Optional[bool] = False) -> bool:
+    if error is None:
+        return optional
+    return (isinstance(error, dict) and set(error) == {'type', 'message', 'traceback'}
+            and all(isinstance(value, str) for value in error.values()))
+
+class NotebookKernel:
+    """
+        A Python interpreter that executes the code cells of
+        a Jupyter Notebook in one shared namespace, like a Jupyter
+        kernel would. Modules imported by a cell are loaded once
+        and stay available to the following cells and to the tests.
+    """
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        self.path = path
+        self.timeout = TIMEOUT if timeout is None else timeout
+        self.proc = None
+        self.conn = None
+        self.cells: List[CellResult] = []
+
+    def start(self) -> None:
+        """
+            Start the kernel in the directory of the notebook.
+        """
+        if self.proc is not None:
+            return
+        parent, child = socket.socketpair()
+        limits = _make_limits(None, None, None, None)
+        with child:
+            self.proc = subprocess.Popen(
+                shlex.split(PYTHON_COMMAND) + ['-c', _NOTEBOOK_KERNEL_CODE, str(child.fileno())],
+                cwd=os.path.dirname(os.path.abspath(self.path)),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                pass_fds=[child.fileno()], preexec_fn=_limits_preexec_fn(limits),
+            )
+        self.conn = Connection(parent.detach())
+
+    def close(self) -> None:
+        """
+            Stop the kernel.
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, *request: Any) -> Any:
+        self.start()
+        try:
+            self.conn.send_bytes(json.dumps(request).encode())
+            if not self.conn.poll(self.timeout):
+                self.close()
+                raise StudentTimeoutError(
+                    f"Notebook cell did not finish within {self.timeout} seconds"
+                )
+            return json.loads(self.conn.recv_bytes())
+        except (EOFError, OSError):
+            returncode = self.proc.poll() if self.proc is not None else None
+            self.close()
+            raise RuntimeError(
+                f"Notebook kernel stopped unexpectedly exit code [{returncode}]"
+            )
+        except ValueError:
+            self.close()
+            raise RuntimeError("Notebook kernel sent a reply that isn't valid JSON")
+
+    def _invalid_reply(self, reply: Any) -> RuntimeError:
+        # The kernel runs student code, which can write to the connection itself
+        self.close()
+        return RuntimeError(f"Notebook kernel sent an invalid reply [{str(reply)[:1000]}]")
+
+    def run_cell(self, source: str, index: Optional[int] = -1) -> CellResult:
+        """
+            Run code in the namespace of the notebook.
+        """
+        reply = self._request('run', source, f'<cell {index}>')
+        if not (isinstance(reply, dict) and set(reply) == {'stdout', 'stderr', 'result', 'error', 'time'}
+                and isinstance(reply['stdout'], str) and isinstance(reply['stderr'], str)
+                and isinstance(reply['result'], (str, type(None)))
+                and _is_error_reply(reply['error'], optional=True)
+                and isinstance(reply['time'], (int, float))):
+            raise self._invalid_reply(reply)
+        return CellResult(index, source, reply['stdout'], reply['stderr'], reply['result'],
+                          reply['error'], float(reply['time']))
+
+    def run_all(self, stop_on_error: Optional[bool] = True) -> List[CellResult]:
+        """
+            Run the code cells of the notebook in order. Like
+            "Run All" in Jupyter, execution stops at the first
+            cell raising an error unless `stop_on_error` is False.
+        """
+        model = load_notebook_model(self.path)
+        if model.error is not None:
+            raise type(model.error)(*model.error.args)
+
+        self.cells = []
+        for index, (cell_type, source) in enumerate(zip(model.types, model.sources)):
+            if cell_type != 'code':
+                continue
+            self.cells.append(self.run_cell(source, index))
+            if stop_on_error and self.cells[-1].error is not None:
+                break
+        return self.cells
+
+    def evaluate_repr(self, expression: str) -> str:
+        """
+            Evaluate an expression in the namespace of the notebook
+            and return the repr of its value. Exceptions raised by the
+            expression are raised as a RuntimeError with the same message.
+        """
+        reply = self._request('eval', expression)
+        if not (isinstance(reply, list) and len(reply) == 2
+                and (reply[0] == 'ok' and isinstance(reply[1], str)
+                     or reply[0] == 'error' and _is_error_reply(reply[1]))):
+            raise self._invalid_reply(reply)
+        status, value = reply
+        if status == 'error':
+            raise RuntimeError(f"{value['type']}: {value['message']}")
+        return value
+
+    def evaluate(self, expression: str) -> Any:
+        """
+            Evaluate an expression in the namespace of the notebook
+            and return its value. Only values that are Python literals
+            (numbers, strings, lists, dicts, ...) can be returned, compare
+            other values as strings with `evaluate_repr`.
+        """
+        value = self.evaluate_repr(expression)
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            raise RuntimeError(
+                f"Value of {expression} is not a literal, compare its repr instead [{value[:1000]}]"
+            )
+
+    def get_variable(self, name: str) -> Any:
+        """
+            Get the value of a variable defined by the notebook.
+        """
+        if not name.isidentifier():
+            raise ValueError(f"'{name}' is not a variable name")
+        return self.evaluate(name)
+
+    @property
+    def errors(self) -> List[CellResult]:
+        return [cell for cell in self.cells if cell.error is not None]
+
+    def output(self) -> str:
+        """
+            Give the stdout of all executed cells, lowercased
+            like the output of `run_student_file`.
+        """
+        return "".join(cell.stdout for cell in self.cells).lower()
+
+# Executed notebooks, keyed by path, see `run_notebook`
+_notebook_kernels: Dict[str, Tuple[Tuple[int, int], NotebookKernel]] = {}
+
+def run_notebook(file_name: str, timeout: Optional[float] = None) -> NotebookKernel:
+    """
+        Execute the code cells of a Jupyter Notebook in SOURCE_DIR.
+        The kernel is shared by all tests of the notebook for as long
+        as the file doesn't change, so tests can inspect its cells
+        and variables without running the notebook again.
+        `timeout` applies to every cell, and to every request made
+        through the returned kernel, also when it is reused. A kernel
+        that timed out is stopped, the next call starts a new one.
+    """
+    path = SOURCE_DIR + file_name
+    # The notebook may read any file next to it
+    _touch(path, open_files=True)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _notebook_kernels.get(path)
+    if cached is not None and cached[0] == key and cached[1].proc is not None:
+        cached[1].timeout = TIMEOUT if timeout is None else timeout
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+
+    kernel = NotebookKernel(path, timeout)
+    if not _notebook_kernels:
+        atexit.register(_close_notebook_kernels)
+    _notebook_kernels[path] = (key, kernel)
+    kernel.run_all()
+    return kernel
+
+def _close_notebook_kernels() -> None:
+    for _, kernel in _notebook_kernels.values():
+        kernel.close()
 
 def lint_jupyter_notebook(file_name):
     """
@@ -71,11 +1820,6 @@ def lint_jupyter_notebook(file_name):
             to format and test a provided Jupyter Notebook.
         """
 
-        get_source = lambda cell: (cell['source']
-                                   if cell['source'].__class__.__name__ == 'str'
-                                   else "".join(cell['source'])
-                                   )
-
         # @message: Deze test controleert of je Jupyter Notebook correct
         # is geformatteerd.
         # Jupyter zou dit standaard moeten regelen, dus controleer of je
@@ -99,17 +1843,15 @@ def lint_jupyter_notebook(file_name):
         # @message: Deze test controleert of je Jupyter Notebook begint met
         # een titel in Markdown aan het begin van je bestand.
         def begint_met_titel(self):
-            notebook = load_notebook()
-
-            cell = notebook['cells'][0]
+            model = load_model()
 
             try:
-                self.assertEqual(cell['cell_type'], 'markdown')
+                self.assertEqual(model.types[0], 'markdown')
             except AssertionError as e:
                 e.args = ("Your Jupyter Notebook doesn't start with a markdown block.",)
                 raise e
 
-            desc = get_source(cell)
+            desc = model.sources[0]
             try:
                 self.assertRegex(desc, r"^\n* *# \S")
             except AssertionError as e:
@@ -134,15 +1876,15 @@ def lint_jupyter_notebook(file_name):
             # In case the title is in a different Markdown cell than
             # the description, (which  some people do) gather all
             # adjacent Markdown cells and look at them together.
-            notebook = load_notebook()
+            model = load_model()
             markdown_cells = []
 
-            for cell in notebook['cells']:
-                if cell['cell_type'] != 'markdown':
+            for cell_type, source in zip(model.types, model.sources):
+                if cell_type != 'markdown':
                     evaluate_markdown_blocks(markdown_cells)
                     markdown_cells = []
                 else:
-                    markdown_cells.append(get_source(cell))
+                    markdown_cells.append(source)
             else:
                 evaluate_markdown_blocks(markdown_cells)
 
@@ -150,12 +1892,7 @@ def lint_jupyter_notebook(file_name):
         # structuur hebben, waar een subheader altijd een niveau dieper
         # is dan de bovenliggende header.
         def opgedeeld_in_headers(self):
-            notebook = load_notebook()
-
-            markdown_cells = "\n\n".join([
-                get_source(cell) for cell in notebook['cells']
-                if cell['cell_type'] == 'markdown'
-            ])
+            markdown_cells = "\n\n".join(load_model().markdown)
 
             headers = re.findall(r"\s?(#+) ([\S ]+)", markdown_cells)
 
@@ -180,24 +1917,22 @@ def lint_jupyter_notebook(file_name):
         # Notebook, dus controleer dat je niet ergens halverwege je bestand
         # over het hoofd hebt gezien.
         def geen_blokken_naast_elkaar(self):
-            notebook = load_notebook()
+            model = load_model()
 
-            block_types = [
-                cell['cell_type'] for cell in notebook['cells']
-            ]
+            block_types = model.types
 
             # Ignore empty code blocks at the end
-            while get_source(notebook['cells'][len(block_types) - 1]) == '':
+            while model.sources[len(block_types) - 1] == '':
                 block_types = block_types[:-1]
 
             for i in range(len(block_types) - 1):
                 # Check if two adjacent blocks are code blocks
                 if block_types[i] == 'code' == block_types[i + 1]:
-                    first_line = get_source(notebook['cells'][i]).split('\n')[0]
+                    first_line = model.sources[i].split('\n')[0]
                     if len(first_line) > 20:
                         first_line = first_line[:17] + '...'
 
-                    second_line = get_source(notebook['cells'][i + 1]).split('\n')[0]
+                    second_line = model.sources[i + 1].split('\n')[0]
                     if len(second_line) > 20:
                         second_line = second_line[:17] + '...'
 
@@ -205,19 +1940,17 @@ def lint_jupyter_notebook(file_name):
                     raise AssertionError(e)
 
         def imports_op_juiste_plek(self):
-            notebook = load_notebook()
-            notebook, modules = open_notebook(notebook)
-            browse_for_used_imports(notebook, modules)
-
-            notebook = nest_document(notebook)
+            model = load_model()
+            if model.import_error is not None:
+                raise type(model.import_error)(*model.import_error.args)
 
-            for module in modules:
-                correct_import = determine_longest_path(notebook, module)
+            for module in model.modules:
+                correct_import = model.placement[module]
                 if correct_import is None:
                     e = f"Module `{module}` is imported but isn't being used anywhere."
                     raise AssertionError(e)
-                if module not in correct_import[-1]['has_imports']:
-                    e = f"Expected module `{module}` to be imported at header `{correct_import[-1]['title']}`."
+                if module not in correct_import['has_imports']:
+                    e = f"Expected module `{module}` to be imported at header `{correct_import['title']}`."
                     raise AssertionError(e)
 
         # Register jupyter notebook tests
@@ -234,6 +1967,15 @@ def lint_jupyter_notebook(file_name):
 
         return test_object
 
+    def load_model(file_name: Optional[str] = file_name) -> NotebookModel:
+        """
+            Load the analyzed Jupyter Notebook shared by all tests.
+        """
+        model = load_notebook_model(SOURCE_DIR + file_name)
+        if model.error is not None:
+            raise type(model.error)(*model.error.args)
+        return model
+
     def load_notebook(file_name: Optional[str] = file_name,
                       nested_format: Optional[bool] = False) -> Dict[str, Any]:
         """
@@ -241,160 +1983,316 @@ def lint_jupyter_notebook(file_name):
             If `nested_format` is True, the Jupyter Notebook is formatted
             in a way where
         """
-        with open(SOURCE_DIR + file_name, 'r', encoding='utf-8') as open_file:
-            n = json.load(open_file)
+        n = load_notebook_model(SOURCE_DIR + file_name).notebook
 
         return n if not nested_format else n  # TODO: Format Notebook nicely
 
-    def find_imported_modules(code: str) -> Generator[str, None, None]:
-        """
-            Detect any modules that are imported in the code.
-            The generator iterates over the found modules.
-        """
-        discovered = re.findall(
-            r"(?:from [\w.\-]+)?\s*import (?:((?:(?: *[\w.\-]+(?: as [\w.\-]+)?),? *)+)|(?:\(\s*)((?:(?: *[\w.\-]+(?: as [\w.\-]+)?),?\s*)+)(?:\s*\))|(?:\*))",
-            code
-        )
+    return add_tests
 
-        for line in discovered:
-            for option in line:
-                for mod in re.findall(
-                        r"(?:(?:(?:[\w.\-]+ as ([\w.\-]+))|([\w.\-]+)),)*(?:(?:[\w.\-]+ as ([\w.\-]+))|([\w.\-]+))",
-                        option):
-                    for result in mod:
-                        if len(result) > 0 and result != "*":
-                            yield result
+@functools.lru_cache(maxsize=1024)
+def parse_code(code: str) -> Optional[ast.Module]:
+    """
+        Parse the source of a code cell. IPython magics and shell
+        commands (lines starting with `%` or `!`) are ignored.
+        Returns None if the cell is not valid Python.
+        Trees are cached and shared, so they must not be modified.
+    """
+    try:
+        return ast.parse(code)
+    except (SyntaxError, ValueError):
+        pass
 
-    def is_code_block(code : str) -> bool:
-        """
-            Determine whether a code block is considered a "code" block.
-        """
-        return re.fullmatch(
-            r"(?:(?:(?:from [\w.\-]+)?\s*import (?:(?:(?:(?: *[\w.\-]+(?: as [\w.\-]+)?),? *)+)|(?:\(\s*)(?:(?:(?: *[\w.\-]+(?: as [\w.\-]+)?),?\s*)+)(?:\s*\))|(?:\*))|(?:#[^\n]+)|(?:\"\"\"(?:.+)\"\"\")|(?:[A-Z][A-Z_\-]*\s*=\s*(?:\d+|(?:\"[^\"]+\")|(?:\'[^\']+\')|(?:\"\"\"[^(?:\"\"\")]+\"\"\"))))\s*)+",
-            code.strip()
-        )
+    code = "\n".join(
+        "" if line.lstrip().startswith(('%', '!')) else line
+        for line in code.split('\n')
+    )
+    try:
+        return ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
 
-    def look_for_necessary(current_modules : List[Any], looking_for_mod : str) -> Generator[Dict[str, Union[int, str, List[Any]]], None, None]:
-        """
-            Look for modules that use a certain module.
-            Yield all paths towards blocks using the module.
-        """
-        cursor = current_modules[-1]
+def scan_import_statements(code: str) -> Generator[ast.stmt, None, None]:
+    """
+        Find import statements in code that doesn't parse as a whole,
+        by parsing every statement starting with `import` or `from`
+        on its own. Statements that don't parse are skipped.
+    """
+    lines = code.split('\n')
+    i = 0
+    while i < len(lines):
+        statement = lines[i].strip()
+        if statement.startswith(('import ', 'from ')):
+            # Parenthesized imports and backslashes continue on the next line
+            while i + 1 < len(lines) and (statement.count('(') > statement.count(')')
+                                          or statement.endswith('\\')):
+                i += 1
+                statement += '\n' + lines[i]
+            try:
+                yield from ast.parse(statement).body
+            except (SyntaxError, ValueError):
+                pass
+        i += 1
 
-        if looking_for_mod in cursor['uses_imports']:
-            yield current_modules
-        else:
-            for child in cursor['children']:
-                yield from look_for_necessary(
-                    current_modules + [child],
-                    looking_for_mod)
+def iter_statements(statements: List[ast.stmt]) -> Generator[ast.stmt, None, None]:
+    """
+        Iterate over statements and all statements nested in them,
+        in source order. Expressions are not visited.
+    """
+    for statement in statements:
+        yield statement
+        for field in ('body', 'orelse', 'finalbody', 'handlers', 'cases'):
+            nested = getattr(statement, field, None)
+            if nested:
+                yield from iter_statements(nested)
 
-    def determine_longest_path(document, given_module):
-        """
-            Determine the longest path that can be made
-            while still covering all relevant nodes.
-        """
-        longest_path: Union[List[Dict], None] = None
+def find_imported_modules(code: str) -> Generator[str, None, None]:
+    """
+        Detect any modules that are imported in the code.
+        The generator iterates over the found modules,
+        in the order in which they are imported.
+    """
+    if 'import' not in code:
+        return
 
-        for path in look_for_necessary(document, given_module):
-            if longest_path is None:
-                longest_path = path
-            else:
-                # Evaluate the longest subpath that is still the same
-                for i in range(len(longest_path)):
-                    if longest_path[i] != path[i]:
-                        longest_path = longest_path[:i]
-                        break
+    tree = parse_code(code)
+    statements = iter_statements(tree.body) if tree is not None else scan_import_statements(code)
+    imports = sorted(
+        (node for node in statements if isinstance(node, (ast.Import, ast.ImportFrom))),
+        key=lambda node: (node.lineno, node.col_offset)
+    )
 
-        return longest_path
+    for node in imports:
+        for alias in node.names:
+            if alias.name != "*":
+                yield alias.asname or alias.name
 
-    def open_notebook(notebook) -> Tuple[List[Dict[str, Union[str, int, List[Any]]]], List[str]]:
-        """
-            Open the Jupyter Notebook and extract
-            the relevant blocks in a useful format.
+def attribute_path(node: ast.Attribute) -> Optional[str]:
+    """
+        Get the dotted name of an attribute access such as `np.random.seed`.
+        Returns None if the attribute isn't accessed on a plain name.
+    """
+    parts = [node.attr]
+    while isinstance(node.value, ast.Attribute):
+        node = node.value
+        parts.append(node.attr)
+    if not isinstance(node.value, ast.Name):
+        return None
+    parts.append(node.value.id)
+    return ".".join(reversed(parts))
 
-            The function returns the format and
-            a list of imported modules it has found.
-        """
-        cells = notebook['cells']
-        cells = [
-            {
-                'type'  : cell['cell_type'],
-                'source': (cell['source'] if cell['source'].__class__.__name__ == 'str' else "".join(cell['source'])),
-            }
-            for cell in cells if cell['cell_type'] in ['markdown', 'code']
-        ]
+def scan_identifiers(code: str) -> Set[str]:
+    """
+        Find identifiers in code that doesn't parse, using the tokenizer.
+        Dotted names are added with every prefix: `os.path.join` adds
+        `os`, `os.path` and `os.path.join`.
+    """
+    identifiers = set()
+    chain: List[str] = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.NAME:
+                chain = chain + [token.string] if chain and chain[-1] == '.' else [token.string]
+                if not keyword.iskeyword(chain[0]):
+                    identifiers.add("".join(chain))
+            elif token.type == tokenize.OP and token.string == '.' and chain and chain[-1] != '.':
+                chain.append('.')
+            elif token.type not in (tokenize.NL, tokenize.COMMENT):
+                chain = []
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return identifiers
 
-        # Group all code with their respective headers
-        header_and_code_only_cells = []
-        found_imports = []
-        seen_markdown_blok = False
-
-        for cell in cells:
-            if cell['type'] == 'markdown':
-                seen_markdown_blok = True
-                for stars, title in re.findall(r"\n\s*(#+) +([^\n]+)\n*", '\n' + cell['source']):
-
-                    # Build header in favourable format
-                    header_and_code_only_cells.append({
-                        'title': stars + ' ' + title,
-                        'header': len(stars),
-                        'code': [],
-                        'children': [],
-                        'uses_imports': [], # Which modules it needs in its code blocks
-                        'has_imports': [],  # Which modules it has imported in its code blocks
-                    })
+@functools.lru_cache(maxsize=1024)
+def find_used_identifiers(code: str) -> FrozenSet[str]:
+    """
+        Collect all names used in the code, including dotted names
+        of attribute accesses, e.g. `np`, `os.path` and `os.path.join`.
+        Names in strings and comments are not included.
+    """
+    tree = parse_code(code)
+    if tree is None:
+        return frozenset(scan_identifiers(code))
 
-            else:
-                if not seen_markdown_blok:
-                    e = "Discovered a code block before any Markdown block. You probably forgot to add a title to the Jupyter Notebook, or you placed the code block in front of it."
-                    raise AssertionError(e)
+    identifiers = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            identifiers.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            dotted = attribute_path(node)
+            if dotted is not None:
+                identifiers.add(dotted)
+    return frozenset(identifiers)
 
-                # Build code and evaluate imports
-                header_and_code_only_cells[-1]['code'].append(cell['source'])
+def is_constant_definition(statement: ast.stmt) -> bool:
+    """
+        Determine whether a statement defines a constant,
+        such as `MAX_SIZE = 10` or `NAME = "Bit"`.
+    """
+    if not isinstance(statement, ast.Assign) or len(statement.targets) != 1:
+        return False
+    target, value = statement.targets[0], statement.value
+    if not isinstance(target, ast.Name) or not re.fullmatch(r"[A-Z][A-Z_]*", target.id):
+        return False
+    if not isinstance(value, ast.Constant):
+        return False
+    return (isinstance(value.value, int) and not isinstance(value.value, bool) and value.value >= 0
+            or isinstance(value.value, str) and value.value != "")
 
-                for module in find_imported_modules(cell['source']):
-                    if module in found_imports:
-                        raise AssertionError(
-                            f"Found variable `{module}` imported multiple times: second import found at header `{header_and_code_only_cells[-1]['title']}`"
-                        )
+def is_code_block(code : str) -> bool:
+    """
+        Determine whether a code block only contains imports,
+        constants, comments and docstrings.
+    """
+    # Most code cells start with a statement that can never be part of
+    # such a block, which is much cheaper to check than parsing the cell.
+    first_line = next((
+        line.strip() for line in code.split('\n')
+        if line.strip() and not line.strip().startswith('#')
+    ), "")
+    if first_line == "":
+        # Only comments
+        return code.strip() != ""
+    if not first_line[0].isupper() and not first_line.startswith(('import ', 'from ', '"', "'", '%', '!')):
+        return False
 
-                    found_imports.append(module)
-                    header_and_code_only_cells[-1]['has_imports'].append(module)
-        return header_and_code_only_cells, found_imports
+    tree = parse_code(code)
+    if tree is None or not tree.body:
+        return False
 
-    def browse_for_used_imports(unnested_cells, modules):
-        """
-            Register in all blocks whether an imported module is used there.
-        """
-        # Look at which modules are used where
-        for header in unnested_cells:
-            for code in header['code']:
-                if not is_code_block(code):
-                    for module in modules:
-                        if module in code:
-                            header['uses_imports'].append(module)
+    return all(
+        isinstance(statement, (ast.Import, ast.ImportFrom))
+        or isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant)
+            and isinstance(statement.value.value, str)
+        or is_constant_definition(statement)
+        for statement in tree.body
+    )
 
-    def nest_document(unnested_cells):
-        """
-            Nest the Jupyter Notebook cells into each other.
-        """
-        # Nest sub-headers as children from headers
-        unnested_cells.reverse()
-        document = []
+def place_imports(document, modules) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+        Determine for every module the header where it should be imported:
+        the lowest common ancestor of all headers using the module.
+        The headers under the last top-level header are searched.
+        Modules that aren't used anywhere are placed at None.
+    """
+    placement: Dict[str, Optional[Dict[str, Any]]] = {module: None for module in modules}
+    if not document:
+        return placement
 
-        for header in unnested_cells:
-            if document == []:
-                document.append(header)
-            else:
-                for subheader in document:
-                    if header['header'] < subheader['header']:
-                        header['children'].append(subheader)
+    # Walk the tree once, remembering the parent and depth of every header
+    # and the first and last header (in document order) using each module.
+    root = document[-1]
+    parent = {id(root): None}
+    depth = {id(root): 0}
+    first: Dict[str, Dict[str, Any]] = {}
+    last: Dict[str, Dict[str, Any]] = {}
 
-                for child in header['children']:
-                    document.remove(child)
+    stack = [root]
+    while stack:
+        header = stack.pop()
+        for module in header['uses_imports']:
+            first.setdefault(module, header)
+            last[module] = header
+        for child in reversed(header['children']):
+            parent[id(child)] = header
+            depth[id(child)] = depth[id(header)] + 1
+            stack.append(child)
 
-                document = [header] + document
-        return document
+    # The lowest common ancestor of the first and last header in
+    # document order is the lowest common ancestor of all of them.
+    for module in modules:
+        if module not in first:
+            continue
+        a, b = first[module], last[module]
+        while depth[id(a)] > depth[id(b)]:
+            a = parent[id(a)]
+        while depth[id(b)] > depth[id(a)]:
+            b = parent[id(b)]
+        while a is not b:
+            a, b = parent[id(a)], parent[id(b)]
+        placement[module] = a
 
-    return add_tests
+    return placement
+
+def open_notebook(cells) -> Tuple[List[Dict[str, Union[str, int, List[Any]]]], List[str]]:
+    """
+        Extract the relevant blocks of a Jupyter Notebook,
+        given as (cell type, source) pairs, in a useful format.
+
+        The function returns the format and
+        a list of imported modules it has found.
+    """
+    cells = [
+        {
+            'type'  : cell_type,
+            'source': source,
+        }
+        for cell_type, source in cells if cell_type in ['markdown', 'code']
+    ]
+
+    # Group all code with their respective headers
+    header_and_code_only_cells = []
+    found_imports = []
+    seen_markdown_blok = False
+
+    for cell in cells:
+        if cell['type'] == 'markdown':
+            seen_markdown_blok = True
+            for stars, title in re.findall(r"\n\s*(#+) +([^\n]+)\n*", '\n' + cell['source']):
+
+                # Build header in favourable format
+                header_and_code_only_cells.append({
+                    'title': stars + ' ' + title,
+                    'header': len(stars),
+                    'code': [],
+                    'children': [],
+                    'uses_imports': [], # Which modules it needs in its code blocks
+                    'has_imports': [],  # Which modules it has imported in its code blocks
+                })
+
+        else:
+            if not seen_markdown_blok:
+                e = "Discovered a code block before any Markdown block. You probably forgot to add a title to the Jupyter Notebook, or you placed the code block in front of it."
+                raise AssertionError(e)
+
+            # Build code and evaluate imports
+            header_and_code_only_cells[-1]['code'].append(cell['source'])
+
+            for module in find_imported_modules(cell['source']):
+                if module in found_imports:
+                    raise AssertionError(
+                        f"Found variable `{module}` imported multiple times: second import found at header `{header_and_code_only_cells[-1]['title']}`"
+                    )
+
+                found_imports.append(module)
+                header_and_code_only_cells[-1]['has_imports'].append(module)
+    return header_and_code_only_cells, found_imports
+
+def browse_for_used_imports(unnested_cells, modules):
+    """
+        Register in all blocks whether an imported module is used there.
+    """
+    # Look at which modules are used where
+    for header in unnested_cells:
+        for code in header['code']:
+            if not is_code_block(code):
+                identifiers = find_used_identifiers(code)
+                header['uses_imports'].extend(
+                    module for module in modules if module in identifiers
+                )
+
+def nest_document(unnested_cells):
+    """
+        Nest the Jupyter Notebook cells into each other.
+        Every header becomes a child of the closest header
+        above it that is bigger. The top-level headers are returned.
+    """
+    document = []
+    # Headers that can still receive children, biggest first
+    stack = []
+
+    for header in unnested_cells:
+        while stack and stack[-1]['header'] >= header['header']:
+            stack.pop()
+        (stack[-1]['children'] if stack else document).append(header)
+        stack.append(header)
+    return document
@@ -0,0 +1,36 @@
+// Jasmine reporter writing the outcome of every spec as JSON to the file
+// in BLAST_REPORT_FILE, used by run-all.py to build a combined report.
+const fs = require('fs');
+
+const OUTCOMES = {passed: 'passed', failed: 'failed', pending: 'skipped', excluded: 'skipped'};
+
+class JsonReporter {
+    constructor() {
+        this.specs = [];
+        this.started = {};
+    }
+
+    specStarted(result) {
+        this.started[result.id] = Date.now();
+    }
+
+    specDone(result) {
+        this.specs.push({
+            id: result.fullName,
+            name: result.description,
+            outcome: OUTCOMES[result.status] || 'error',
+            time: (Date.now() - this.started[result.id]) / 1000,
+            message: result.failedExpectations.map(e => e.message).join('\n') || result.pendingReason || '',
+        });
+    }
+
+    jasmineDone(result) {
+        // Errors outside of specs, e.g. in afterAll or while loading a spec file
+        for (const expectation of result.failedExpectations || []) {
+            this.specs.push({id: 'jasmine', name: 'jasmine', outcome: 'error', time: 0, message: expectation.message});
+        }
+        fs.writeFileSync(process.env.BLAST_REPORT_FILE, JSON.stringify(this.specs));
+    }
+}
+
+module.exports = JsonReporter;
@@ -0,0 +1,77 @@
+"""
+    Tests of batch-grade.py. Run from blast-playground with:
+    python -m unittest discover -s tests/python
+"""
+import os
+import sys
+import glob
+import json
+import time
+import tempfile
+import subprocess
+import unittest
+
+BLAST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+TESTS = """
+import unittest
+import testUtils
+
+class TestProgram(unittest.TestCase):
+    def test_Output(self):
+        self.assertEqual(testUtils.run_student_file('program.py', cache=False), 'hello\\n')
+"""
+
+
+def processes_using(path: str) -> list:
+    """
+        Pids of the processes with `path` in their command line.
+    """
+    pids = []
+    for cmdline in glob.glob('/proc/[0-9]*/cmdline'):
+        try:
+            with open(cmdline, 'rb') as open_file:
+                if path.encode() in open_file.read():
+                    pids.append(int(cmdline.split('/')[2]))
+        except OSError:
+            pass  # Exited in the meantime
+    return pids
+
+
+@unittest.skipUnless(os.path.isdir('/proc'), "needs /proc to find processes")
+class TestBatchGradeWarm(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='blast-test-')
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Warm interpreters create their socket directories in here
+        self.temp_dir = os.path.join(directory.name, 'tmp')
+        os.mkdir(self.temp_dir)
+        with open(os.path.join(directory.name, 'tests.py'), 'w', encoding='utf-8') as open_file:
+            open_file.write(TESTS)
+        for name in ['alice', 'bob', 'carol']:
+            os.makedirs(os.path.join(directory.name, 'submissions', name))
+            with open(os.path.join(directory.name, 'submissions', name, 'program.py'), 'w', encoding='utf-8') as open_file:
+                open_file.write('print("Hello")\n')
+
+    def test_NothingSurvivesTheRun(self):
+        proc = subprocess.run(
+            [sys.executable, os.path.join(BLAST_DIR, 'batch-grade.py'), 'submissions',
+             '--tests', 'tests.py', '--workers', '2', '--warm', '--store', 'store'],
+            cwd=self.directory, env={**os.environ, 'TMPDIR': self.temp_dir},
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=120,
+        )
+        self.assertEqual(proc.returncode, 0)
+        reports = json.loads(proc.stdout)['submissions']
+        self.assertEqual([report['passed'] for report in reports], [1, 1, 1])
+
+        deadline = time.monotonic() + 10
+        while (processes_using(self.temp_dir) or os.listdir(self.temp_dir)) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(processes_using(self.temp_dir), [])
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
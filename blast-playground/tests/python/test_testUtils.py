@@ -0,0 +1,210 @@
+"""
+    Tests of testUtils itself. Run from blast-playground with:
+    python -m unittest discover -s tests/python
+"""
+import os
+import sys
+import json
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import testUtils
+
+# Fails on the input `fail`, keeps running on any other input
+PROGRAM = """
+import time
+if input() == "fail":
+    1/0
+time.sleep(60)
+print("done")
+"""
+
+
+class TestRunStudentFileCases(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='blast-test-')
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, testUtils, 'SOURCE_DIR', testUtils.SOURCE_DIR)
+        testUtils.SOURCE_DIR = os.path.join(directory.name, '')
+        with open(os.path.join(directory.name, 'program.py'), 'w', encoding='utf-8') as open_file:
+            open_file.write(PROGRAM)
+
+    def run_cases(self, cases, **kwargs):
+        """
+            Run the cases in a thread, so a hanging call fails the test
+            instead of blocking the test run.
+        """
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = testUtils.run_student_file_cases('program.py', cases, **kwargs)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), "run_student_file_cases didn't return")
+        return outcome
+
+    def test_FailingCaseIsRaisedWithoutWaitingForTheOthers(self):
+        outcome = self.run_cases([(['fail'], None)] + [(['wait'], seed) for seed in range(3)])
+        self.assertIsInstance(outcome.get('error'), RuntimeError)
+        self.assertIn("ZeroDivisionError", str(outcome['error']))
+
+    def test_EveryCaseFailing(self):
+        outcome = self.run_cases([(['fail'], seed) for seed in range(3)])
+        self.assertIsInstance(outcome.get('error'), RuntimeError)
+
+    def test_FailingCasesAreReturned(self):
+        outcome = self.run_cases([(['fail'], None), (['wait'], None)], return_exceptions=True, timeout=1)
+        failed, timed_out = outcome['result']
+        self.assertIsInstance(failed, RuntimeError)
+        self.assertIsInstance(timed_out, testUtils.StudentTimeoutError)
+
+
+# Relies on the interpreter shutting down normally
+EXITING_PROGRAM = """
+import atexit, threading, time
+atexit.register(print, "exit handler")
+threading.Thread(target=lambda: (time.sleep(0.2), print("thread"))).start()
+unclosed = open(input(), "w")
+unclosed.write("unclosed file")
+"""
+
+
+class TestInterpreterShutdown(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='blast-test-')
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, testUtils, 'SOURCE_DIR', testUtils.SOURCE_DIR)
+        testUtils.SOURCE_DIR = os.path.join(directory.name, '')
+        with open(os.path.join(directory.name, 'program.py'), 'w', encoding='utf-8') as open_file:
+            open_file.write(EXITING_PROGRAM)
+        self.output_file = os.path.join(directory.name, 'output.txt')
+
+    def assertShutdownComplete(self, **kwargs):
+        result = testUtils.measure_student_file('program.py', [self.output_file], **kwargs)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.output.split(), ['thread', 'exit', 'handler'])
+        with open(self.output_file, encoding='utf-8') as open_file:
+            self.assertEqual(open_file.read(), "unclosed file")
+
+    def test_Subprocess(self):
+        self.assertShutdownComplete()
+
+    def test_WarmInterpreter(self):
+        testUtils.use_warm_interpreter()
+        self.addCleanup(testUtils.use_warm_interpreter, False)
+        self.assertShutdownComplete()
+
+    def test_SeededWarmInterpreter(self):
+        # The seeded bootstrap runs the program in a namespace of its own
+        testUtils.use_warm_interpreter()
+        self.addCleanup(testUtils.use_warm_interpreter, False)
+        self.assertShutdownComplete(seed=1)
+
+
+@unittest.skipIf(testUtils.black is None, "needs the black package")
+class TestRunFormatter(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='blast-test-')
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, testUtils, 'SOURCE_DIR', testUtils.SOURCE_DIR)
+        self.addCleanup(setattr, testUtils, 'FORMATTER_CACHE', testUtils.FORMATTER_CACHE)
+        testUtils.SOURCE_DIR = os.path.join(directory.name, 'src', '')
+        testUtils.FORMATTER_CACHE = os.path.join(directory.name, 'cache.json')
+        os.mkdir(testUtils.SOURCE_DIR)
+
+    def write(self, name, data):
+        with open(testUtils.SOURCE_DIR + name, 'wb') as open_file:
+            open_file.write(data)
+
+    def read(self, name):
+        with open(testUtils.SOURCE_DIR + name, 'rb') as open_file:
+            return open_file.read()
+
+    def test_KeepsEncodingAndNewlines(self):
+        self.write('latin.py', '# -*- coding: latin-1 -*-\r\nx  =  "é"\r\n'.encode('latin-1'))
+        testUtils.run_formatter()
+        self.assertEqual(self.read('latin.py'), '# -*- coding: latin-1 -*-\r\nx = "é"\r\n'.encode('latin-1'))
+
+    def test_LeavesUnparsableFilesAlone(self):
+        self.write('broken.py', b'def f(:\n')
+        self.write('fine.py', b'y  = 1\n')
+        testUtils.run_formatter()
+        self.assertEqual(self.read('broken.py'), b'def f(:\n')
+        self.assertEqual(self.read('fine.py'), b'y = 1\n')
+
+
+class TestRunNotebook(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='blast-test-')
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, testUtils, 'SOURCE_DIR', testUtils.SOURCE_DIR)
+        self.addCleanup(testUtils._close_notebook_kernels)
+        testUtils.SOURCE_DIR = os.path.join(directory.name, '')
+        notebook = {
+            'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5,
+            'cells': [{'cell_type': 'code', 'metadata': {}, 'outputs': [], 'execution_count': None,
+                       'source': ["import time\n", "x = 1\n"]}],
+        }
+        with open(os.path.join(directory.name, 'notebook.ipynb'), 'w', encoding='utf-8') as open_file:
+            json.dump(notebook, open_file)
+
+    def test_TimeoutOfReusedKernel(self):
+        kernel = testUtils.run_notebook('notebook.ipynb', timeout=30)
+        self.assertIs(testUtils.run_notebook('notebook.ipynb', timeout=0.5), kernel)
+        started = time.monotonic()
+        with self.assertRaises(testUtils.StudentTimeoutError):
+            kernel.run_cell('time.sleep(10)')
+        self.assertLess(time.monotonic() - started, 5)
+
+        restarted = testUtils.run_notebook('notebook.ipynb')
+        self.assertIsNot(restarted, kernel)
+        self.assertEqual(restarted.get_variable('x'), 1)
+
+
+class TestWarmInterpreter(unittest.TestCase):
+
+    def kill(self, pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def test_StopsWithItsParent(self):
+        # The parent leaves without closing the warm interpreter
+        parent = subprocess.run(
+            [sys.executable, '-c', 'import os, sys, testUtils\n'
+             'warm = testUtils.WarmInterpreter()\n'
+             'warm.start()\n'
+             'print(warm.proc.pid, warm.socket_dir, flush=True)\n'
+             'os._exit(0)\n'],
+            cwd=os.path.dirname(os.path.abspath(testUtils.__file__)),
+            stdout=subprocess.PIPE, text=True, timeout=30,
+        )
+        pid, socket_dir = parent.stdout.split()
+        self.addCleanup(self.kill, int(pid))
+        deadline = time.monotonic() + 10
+        while os.path.exists(socket_dir) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(os.path.exists(socket_dir))
+        with self.assertRaises(ProcessLookupError):
+            while time.monotonic() < deadline:
+                os.kill(int(pid), 0)
+                time.sleep(0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+"""
+chapters.py
+
+Chapter index and thumbnail sprite sheet, generated while rendering a recording
+"""
+from dataclasses import dataclass, asdict
+import math
+import json
+import os
+
+# Passed to agg, so that chapter times can be mapped to the rendered video
+IDLE_TIME_LIMIT = 5
+# Frame rate used to sample thumbnails from the rendered recording
+THUMBNAIL_FPS = 10
+THUMBNAIL_WIDTH = 320
+SPRITE_COLUMNS = 5
+
+
+@dataclass
+class Chapter:
+    """A chapter marks the part of a recording belonging to a single command.
+
+    Attributes:
+        title: command typed at the start of the chapter
+        start: start of chapter in seconds
+        end: end of chapter in seconds
+        thumbnail: "x,y,w,h" region of the chapter thumbnail in the sprite sheet
+    """
+
+    title: str
+    start: float
+    end: float = 0.0
+    thumbnail: str = ""
+
+
+def write_run_chapters(
+    filename: str, origin: float, chapters: list[tuple[str, float]]
+) -> None:
+    """Store the start of each command as measured in run mode.
+
+    Params:
+        filename: filepath to write to
+        origin: monotonic time at which run mode started writing output
+        chapters: list of (command, monotonic start time)
+    """
+    with open(filename, "w") as f:
+        json.dump([[title, start - origin] for title, start in chapters], f)
+
+
+def read_run_chapters(filename: str) -> list[Chapter]:
+    """Read chapters stored by write_run_chapters.
+
+    Params:
+        filename: filepath written by run mode
+
+    Returns:
+        list of chapters, with start times relative to the start of run mode.
+    """
+    if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+        return []
+    with open(filename) as f:
+        return [Chapter(title, start) for title, start in json.load(f)]
+
+
+def read_cast_output_times(cast_filename: str) -> list[float]:
+    """Read the timestamps of all output events in an asciinema recording.
+
+    Both the v2 (absolute timestamps) and v3 (intervals) formats are supported.
+
+    Params:
+        cast_filename: filepath of asciinema recording
+
+    Returns:
+        list of absolute timestamps in seconds.
+    """
+    times = []
+    with open(cast_filename) as f:
+        header = json.loads(f.readline())
+        relative = header.get("version", 2) >= 3
+        now = 0.0
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            timestamp, kind, _ = json.loads(line)
+            now = now + timestamp if relative else timestamp
+            if kind == "o":
+                times.append(now)
+    return times
+
+
+def cast_to_video_time(
+    output_times: list[float], t: float, idle_time_limit: float = IDLE_TIME_LIMIT
+) -> float:
+    """Map a moment in an asciinema recording to the video rendered by agg.
+
+    agg shortens every pause between output events to at most idle_time_limit.
+
+    Params:
+        output_times: timestamps of output events in the recording
+        t: moment in the recording
+        idle_time_limit: longest pause kept by agg
+
+    Returns:
+        The same moment in the rendered video, in seconds.
+    """
+    video_time, previous = 0.0, 0.0
+    for event_time in output_times:
+        if event_time > t:
+            break
+        video_time += min(event_time - previous, idle_time_limit)
+        previous = event_time
+    return video_time + min(t - previous, idle_time_limit)
+
+
+def align_chapters(chapters: list[Chapter], cast_filename: str) -> list[Chapter]:
+    """Convert chapter times measured in run mode to times in the rendered video.
+
+    Run mode writes the prompt as its first output, so the first output event
+    of the recording marks the start of run mode.
+
+    Params:
+        chapters: chapters read with read_run_chapters
+        cast_filename: filepath of asciinema recording
+
+    Returns:
+        The chapters with start and end times in the rendered video.
+    """
+    output_times = read_cast_output_times(cast_filename)
+    if not chapters or not output_times:
+        return []
+    offset = output_times[0]
+    duration = cast_to_video_time(output_times, output_times[-1])
+    aligned = [
+        Chapter(c.title, cast_to_video_time(output_times, offset + c.start))
+        for c in chapters
+    ]
+    for chapter, next_chapter in zip(aligned, aligned[1:]):
+        chapter.end = next_chapter.start
+    aligned[-1].end = max(duration, aligned[-1].start)
+    return aligned
+
+
+def read_gif_size(gif_filename: str) -> tuple[int, int]:
+    """Read the dimensions of a GIF from its header, without decoding it.
+
+    Params:
+        gif_filename: filepath of GIF image
+
+    Returns:
+        (width, height) in pixels.
+    """
+    with open(gif_filename, "rb") as f:
+        header = f.read(10)
+    return int.from_bytes(header[6:8], "little"), int.from_bytes(header[8:10], "little")
+
+
+def sprite_filter(chapters: list[Chapter], gif_filename: str) -> tuple[str, str]:
+    """Build an ffmpeg filter that samples one thumbnail per chapter into a sprite.
+
+    Every thumbnail shows the terminal just before the next chapter starts,
+    so it includes the output of the command. The thumbnail regions are stored
+    in the chapters.
+
+    Params:
+        chapters: aligned chapters
+        gif_filename: filepath of GIF rendered by agg
+
+    Returns:
+        (filter, label): a filtergraph chain reading from label '[thumbs]' and
+        the label of its output.
+    """
+    width, height = read_gif_size(gif_filename)
+    thumb_width = THUMBNAIL_WIDTH
+    thumb_height = 2 * max(1, round(thumb_width * height / max(width, 1) / 2))
+    columns = min(len(chapters), SPRITE_COLUMNS)
+    rows = math.ceil(len(chapters) / columns)
+
+    frames = []
+    for i, chapter in enumerate(chapters):
+        moment = max(chapter.start, chapter.end - 0.5)
+        frames.append(f"eq(n\\,{int(moment * THUMBNAIL_FPS)})")
+        x, y = (i % columns) * thumb_width, (i // columns) * thumb_height
+        chapter.thumbnail = f"{x},{y},{thumb_width},{thumb_height}"
+
+    chain = (
+        f"[thumbs]fps={THUMBNAIL_FPS},select={'+'.join(frames)},"
+        f"scale={thumb_width}:{thumb_height},tile={columns}x{rows}[sprite]"
+    )
+    return chain, "[sprite]"
+
+
+def format_timestamp(seconds: float) -> str:
+    """Format seconds as a WebVTT timestamp (hh:mm:ss.ttt)."""
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+
+def format_chapters_vtt(chapters: list[Chapter]) -> str:
+    """Format chapters as a WebVTT chapter track."""
+    cues = ["WEBVTT", ""]
+    for i, chapter in enumerate(chapters):
+        cues += [
+            str(i + 1),
+            f"{format_timestamp(chapter.start)} --> {format_timestamp(chapter.end)}",
+            chapter.title,
+            "",
+        ]
+    return "\n".join(cues)
+
+
+def format_thumbnails_vtt(chapters: list[Chapter], sprite_filename: str) -> str:
+    """Format chapter thumbnails as a WebVTT track of sprite regions."""
+    cues = ["WEBVTT", ""]
+    for chapter in chapters:
+        cues += [
+            f"{format_timestamp(chapter.start)} --> {format_timestamp(chapter.end)}",
+            f"{sprite_filename}#xywh={chapter.thumbnail}",
+            "",
+        ]
+    return "\n".join(cues)
+
+
+def write_chapter_index(
+    chapters: list[Chapter], prefix: str, sprite_filename: str = ""
+) -> list[str]:
+    """Write chapter index files next to a video.
+
+    Files written:
+        <prefix>.chapters.json   chapters as JSON
+        <prefix>.chapters.vtt    WebVTT chapter track
+        <prefix>.thumbnails.vtt  WebVTT thumbnail track (only if sprite_filename)
+
+    Params:
+        chapters: aligned chapters
+        prefix: filepath without extension of the video
+        sprite_filename: filepath of thumbnail sprite sheet, if it was rendered
+
+    Returns:
+        list of written filepaths.
+    """
+    files = {
+        f"{prefix}.chapters.json": json.dumps(
+            [asdict(c) for c in chapters], indent=2
+        ),
+        f"{prefix}.chapters.vtt": format_chapters_vtt(chapters),
+    }
+    if sprite_filename:
+        files[f"{prefix}.thumbnails.vtt"] = format_thumbnails_vtt(
+            chapters, os.path.basename(sprite_filename)
+        )
+    for filename, contents in files.items():
+        with open(filename, "w") as f:
+            f.write(contents)
+    return list(files)
@@ -0,0 +1,280 @@
+"""
+jobqueue.py
+
+Job queue on a shared filesystem, used by distributed crawl mode
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+import threading
+import shutil
+import socket
+import pickle
+import json
+import time
+import os
+
+from helpers import Config
+
+JOBS_DIR = "jobs"
+CLAIMS_DIR = "claims"
+RESULTS_DIR = "results"
+SEALED_MARKER = "SEALED"
+LEASE = 300  # seconds a claim stays valid without a heartbeat from its worker
+
+
+@dataclass
+class Job:
+    """A job is a prepared configuration waiting to be recorded by a worker.
+
+    Attributes:
+        id: name of the job, unique within its queue
+        dir: absolute path of the directory containing the configuration
+        config: prepared configuration (stdout byte sizes already calculated)
+        output_filename: filename for recorded video, relative to dir
+        options: keyword arguments passed on to do_record (theme, cols, ...)
+    """
+
+    id: str
+    dir: str
+    config: Config
+    output_filename: str = "output.mp4"
+    options: dict = field(default_factory=dict)
+
+
+@dataclass
+class JobResult:
+    """Outcome of a job, published by the worker that recorded it.
+
+    Attributes:
+        id: name of the job
+        dir: directory in which the job was recorded
+        success: True if the recording succeeded
+        host: hostname of the worker
+        pid: process id of the worker
+        started: UNIX timestamp when the worker started the job
+        finished: UNIX timestamp when the worker finished the job
+        error: why the job failed, if recording raised an exception
+    """
+
+    id: str
+    dir: str
+    success: bool
+    host: str = ""
+    pid: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+    error: str = ""
+
+
+def worker_name() -> str:
+    """Name identifying this process across all hosts sharing a queue."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def atomic_write(filename: str, data: bytes) -> None:
+    """Write data to filename so other hosts never observe a partial file.
+
+    The data is written to a temporary file next to filename, which is
+    renamed over filename afterwards. Renames within a directory are atomic,
+    also on NFS.
+
+    Params:
+        filename: destination filepath
+        data: file contents
+    """
+    tmp_filename = f"{filename}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class JobQueue:
+    """Directory based job queue shared by a coordinator and its workers.
+
+    Layout of the queue directory:
+        jobs/<id>.job       pickled Job, written by the coordinator
+        claims/<id>.lock    created exclusively by the worker claiming a job,
+                            holds its name and latest heartbeat timestamp
+        results/<id>.json   JobResult, published by the worker
+        SEALED              created by the coordinator once all jobs are seeded
+
+    Workers claim a job by creating its lock file with O_EXCL, so every job
+    is recorded by exactly one worker. While recording, a worker writes
+    a heartbeat timestamp into its lock file. A claim whose lock file didn't change
+    for longer than the lease, as timed by the observer's own clock, belongs to
+    a worker that died and is removed so the job is claimed again. Clocks of
+    different hosts are never compared.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        # Contents of every claim seen by requeue_stale and when they were first seen
+        self._claims_seen: dict[str, tuple[str, float]] = {}
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.path, *parts)
+
+    def exists(self) -> bool:
+        """Check if the queue directory has been created by a coordinator."""
+        return os.path.isdir(self._path(JOBS_DIR))
+
+    def create(self) -> bool:
+        """Create an empty queue directory.
+
+        Returns:
+            False if the directory already holds a queue, True otherwise.
+        """
+        if self.exists() and os.listdir(self._path(JOBS_DIR)):
+            return False
+        for sub_dir in [JOBS_DIR, CLAIMS_DIR, RESULTS_DIR]:
+            os.makedirs(self._path(sub_dir), exist_ok=True)
+        return True
+
+    def put(self, job: Job) -> None:
+        """Add a job to the queue."""
+        atomic_write(self._path(JOBS_DIR, f"{job.id}.job"), pickle.dumps(job))
+
+    def remove(self) -> None:
+        """Remove the queue directory, so the next crawl can create a new queue."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def seal(self) -> None:
+        """Mark the queue as complete: no more jobs will be added."""
+        atomic_write(self._path(SEALED_MARKER), worker_name().encode())
+
+    def is_sealed(self) -> bool:
+        return os.path.exists(self._path(SEALED_MARKER))
+
+    def job_ids(self) -> list[str]:
+        """List the ids of all jobs in the queue, in order."""
+        return sorted(
+            name.removesuffix(".job")
+            for name in os.listdir(self._path(JOBS_DIR))
+            if name.endswith(".job")
+        )
+
+    def claim(self) -> Job | None:
+        """Claim the first job that has not been claimed by any worker.
+
+        Returns:
+            The claimed job, or None if every job has been claimed.
+        """
+        for job_id in self.job_ids():
+            try:
+                fd = os.open(
+                    self._path(CLAIMS_DIR, f"{job_id}.lock"),
+                    os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                )
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{worker_name()}\n{time.time()}")
+            with open(self._path(JOBS_DIR, f"{job_id}.job"), "rb") as f:
+                return pickle.load(f)
+        return None
+
+    def has_result(self, job_id: str) -> bool:
+        return os.path.exists(self._path(RESULTS_DIR, f"{job_id}.json"))
+
+    def is_done(self) -> bool:
+        """Check if every job in the queue has a published result."""
+        return all(self.has_result(job_id) for job_id in self.job_ids())
+
+    def _read_claim(self, job_id: str) -> str:
+        try:
+            with open(self._path(CLAIMS_DIR, f"{job_id}.lock")) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+
+    def renew(self, job_id: str) -> bool:
+        """Extend the lease on a job claimed by this worker.
+
+        Returns:
+            False if the claim was released and possibly claimed by another worker.
+        """
+        name = self._read_claim(job_id).split("\n")[0]
+        if name != worker_name():
+            return False
+        atomic_write(
+            self._path(CLAIMS_DIR, f"{job_id}.lock"), f"{name}\n{time.time()}".encode()
+        )
+        return True
+
+    @contextmanager
+    def heartbeat(self, job_id: str, lease: float = LEASE):
+        """Renew the lease on a claimed job in the background until the block exits.
+
+        Params:
+            job_id: id of the job claimed by this worker
+            lease: seconds a claim stays valid, renewed three times per lease
+        """
+        stopped = threading.Event()
+
+        def renew_until_stopped() -> None:
+            while not stopped.wait(lease / 3):
+                try:
+                    if not self.renew(job_id):
+                        return
+                except OSError:
+                    pass  # Shared filesystem hiccup, try again next beat
+
+        thread = threading.Thread(target=renew_until_stopped, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def requeue_stale(self, lease: float = LEASE) -> list[str]:
+        """Release claims whose worker stopped renewing them, so they are claimed again.
+
+        Params:
+            lease: seconds a claim stays valid without a heartbeat
+
+        Returns:
+            Ids of the jobs that were released.
+        """
+        released = []
+        now = time.monotonic()
+        for job_id in self.job_ids():
+            claim = self._read_claim(job_id)
+            if not claim or self.has_result(job_id):
+                self._claims_seen.pop(job_id, None)
+                continue
+            seen = self._claims_seen.get(job_id)
+            if seen is None or seen[0] != claim:
+                # New claim or new heartbeat, the lease starts over
+                self._claims_seen[job_id] = (claim, now)
+            elif now - seen[1] > lease:
+                try:
+                    os.remove(self._path(CLAIMS_DIR, f"{job_id}.lock"))
+                    released.append(job_id)
+                except FileNotFoundError:
+                    pass  # Released by another worker
+                del self._claims_seen[job_id]
+        return released
+
+    def publish(self, result: JobResult) -> None:
+        """Publish the result of a claimed job."""
+        atomic_write(
+            self._path(RESULTS_DIR, f"{result.id}.json"),
+            json.dumps(asdict(result)).encode(),
+        )
+
+    def results(self) -> list[JobResult]:
+        """Collect all published results, in job order."""
+        results = []
+        for name in sorted(os.listdir(self._path(RESULTS_DIR))):
+            if not name.endswith(".json"):
+                continue
+            with open(self._path(RESULTS_DIR, name), "rb") as f:
+                results.append(JobResult(**json.load(f)))
+        return results
+
+    def claimed_by(self, job_id: str) -> str:
+        """Get the name of the worker that claimed a job, if any."""
+        return self._read_claim(job_id).split("\n")[0]
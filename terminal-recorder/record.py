@@ -4,6 +4,7 @@ from collections.abc import Callable
 from typing import IO
 import subprocess
 import tempfile
+import shlex
 import argparse
 import shutil
 import pickle
@@ -12,9 +13,20 @@ import os
 
 from helpers import *
 from configparse import parse_config
-
-
-def type_and_run_commands(prompt: str, commands: list[Command]) -> bool:
+from jobqueue import LEASE, Job, JobQueue, JobResult, worker_name
+from chapters import (
+    IDLE_TIME_LIMIT,
+    read_run_chapters,
+    align_chapters,
+    sprite_filter,
+    write_run_chapters,
+    write_chapter_index,
+)
+
+
+def type_and_run_commands(
+    prompt: str, commands: list[Command], chapters: list | None = None
+) -> bool:
     """Execute a list of commands: type input in a terminal and displaying output.
 
     Commands are considered to have executed successfully if they have returncode 0
@@ -23,6 +35,7 @@ def type_and_run_commands(prompt: str, commands: list[Command]) -> bool:
     Params:
         prompt: prompt to display in terminal
         commands: list of commands to execute in terminal
+        chapters: if given, (command, monotonic start time) is appended for each command
 
     Returns:
         True if every command executed successfully, False otherwise.
@@ -30,6 +43,8 @@ def type_and_run_commands(prompt: str, commands: list[Command]) -> bool:
 
     no_error = True
     for command in commands:
+        if chapters is not None:
+            chapters.append((command.command, time.monotonic()))
         raw_write(prompt, end=" ")
         time.sleep(1)
 
@@ -71,7 +86,7 @@ def type_and_run_commands(prompt: str, commands: list[Command]) -> bool:
     return no_error
 
 
-def execute_config(config: Config) -> bool:
+def execute_config(config: Config, chapters: list | None = None) -> bool:
     """Execute all commands in a configuration.
 
     Because we want to intermingle stdout and stdin, the commands must have
@@ -80,6 +95,7 @@ def execute_config(config: Config) -> bool:
 
     Params:
         config: configuration to execute
+        chapters: if given, (command, monotonic start time) is appended for each command
 
     Returns:
         True if configuration executed without problems, False otherwise
@@ -93,12 +109,14 @@ def execute_config(config: Config) -> bool:
 
     cwd = os.getcwd()
     os.chdir(config.dir)
-    result = type_and_run_commands(prompt, config.commands)
+    result = type_and_run_commands(prompt, config.commands, chapters)
     os.chdir(cwd)
     return result
 
 
-def do_run(config_filename: str, pickled=False) -> tuple[bool, Config]:
+def do_run(
+    config_filename: str, pickled=False, chapters_filename: str = ""
+) -> tuple[bool, Config]:
     """Run mode: type commands on stdin and print stdout output.
 
     The execution of this function is what is to be recorded by asciinema.
@@ -107,6 +125,7 @@ def do_run(config_filename: str, pickled=False) -> tuple[bool, Config]:
         config_filename: either a filepath to a valid TOML configuration describing
                          commands to be run, or filepath to a pickled Config object
         pickled: True if 'config_filename' stores a pickled Config object
+        chapters_filename: if given, filepath to store the start time of each command
 
     Returns:
         (success, config), where:
@@ -119,7 +138,13 @@ def do_run(config_filename: str, pickled=False) -> tuple[bool, Config]:
         success, config = parse_config(config_filename)
         if not success:
             return False, config
-    result = execute_config(config)
+    if not chapters_filename:
+        return execute_config(config), config
+
+    chapters = []
+    origin = time.monotonic()
+    result = execute_config(config, chapters)
+    write_run_chapters(chapters_filename, origin, chapters)
     return result, config
 
 
@@ -215,6 +240,8 @@ def do_record(
     dir: str | None = None,
     pickled: bool = False,
     overwrite_output: bool = True,
+    chapters: bool = False,
+    chapters_prefix: str = "",
 ) -> bool:
     """Record mode: record a terminal video.
 
@@ -222,6 +249,10 @@ def do_record(
     This subprocess is recorded by asciinema.
     Afterwards, the recording is converted to a video using agg and ffmpeg.
 
+    With chapters enabled, run mode stores when each command starts. These times
+    are mapped onto the rendered recording to write a chapter index, and ffmpeg
+    samples a thumbnail sprite sheet in the same pass that encodes the video.
+
 
     Params:
         config_filename: filepath to (pickled) TOML configuration
@@ -233,6 +264,9 @@ def do_record(
         dir: directory to switch to before recording
         pickled: True if config_filename is pickled Config object
         overwrite_output: don't ask before overwriting output_filename
+        chapters: also write a chapter index and thumbnail sprite sheet
+        chapters_prefix: filepath prefix of chapter files (default: output_filename
+                         without extension)
 
     Returns:
        True if run mode returned True and recording and conversion
@@ -272,17 +306,60 @@ def do_record(
 
     files = [
         tempfile.NamedTemporaryFile(suffix=suffix)
-        for suffix in ["", ".gif", ".mp4"]
+        for suffix in ["", ".gif", ".mp4", ".json", ".jpg"]
     ]
-    rec, gif, output = files
-    
-    # Warn: The values within scales are escaped
-    ffmpeg_options = "-movflags faststart -pix_fmt yuv420p -vf scale=trunc\(iw/2\)*2:trunc\(ih/2\)*2"
+    rec, gif, output, run_chapters, sprite = files
+
+    if chapters:
+        recording_subcmd += f" --chapters-file {run_chapters.name}"
+
+    ffmpeg_input = ["ffmpeg", "-y", "-i", gif.name]
+    ffmpeg_options = ["-movflags", "faststart", "-pix_fmt", "yuv420p"]
+    aligned_chapters = []
+
+    def ffmpeg_cmd() -> list[str]:
+        """Build the ffmpeg argv, sampling chapter thumbnails if chapters were recorded.
+
+        The argv runs without a shell, so filter graphs and stream labels
+        like [out] reach ffmpeg as they are.
+        """
+        nonlocal aligned_chapters
+        aligned_chapters = align_chapters(read_run_chapters(run_chapters.name), rec.name)
+        if not aligned_chapters:
+            return [
+                *ffmpeg_input,
+                *ffmpeg_options,
+                "-vf",
+                "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+                output.name,
+            ]
+        thumbnail_chain, sprite_label = sprite_filter(aligned_chapters, gif.name)
+        graph = (
+            "[0:v]split[video][thumbs];"
+            "[video]scale=trunc(iw/2)*2:trunc(ih/2)*2[out];"
+            + thumbnail_chain
+        )
+        return [
+            *ffmpeg_input,
+            "-filter_complex",
+            graph,
+            "-map",
+            "[out]",
+            *ffmpeg_options,
+            output.name,
+            "-map",
+            sprite_label,
+            "-frames:v",
+            "1",
+            "-update",
+            "1",
+            sprite.name,
+        ]
 
     cmds = [
         f"asciinema rec -c '{recording_subcmd}' {rec.name}",
-        f"agg {rec.name} {gif.name} --theme {theme} --font-size {font_size} --cols {cols} --rows {rows}",
-        f"ffmpeg -y -i {gif.name} {ffmpeg_options} {output.name}"
+        f"agg {rec.name} {gif.name} --theme {theme} --font-size {font_size} --cols {cols} --rows {rows} --idle-time-limit {IDLE_TIME_LIMIT}",
+        ffmpeg_cmd,
     ]
 
     divide = "-" * cols
@@ -291,23 +368,116 @@ def do_record(
         if i == 1:
             print(divide)
             print_info("Converting recording...")
+        if callable(cmd):
+            cmd = cmds[i] = cmd()
+        # Commands built as argv lists run without a shell
         proc = subprocess.run(
-            cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            cmd,
+            shell=isinstance(cmd, str),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
         )
 
         if proc.returncode != 0:
+            if isinstance(cmd, list):
+                cmd = shlex.join(cmd)
             print_error(
-                f"Encountered error when recording and converting. Command: '{cmds[i]}'"
+                f"Encountered error when recording and converting. Command: '{cmd}'"
             )
             die()
             return False
 
     if overwrite_output or should_make_output_file(output_filename):
         shutil.copy(output.name, output_filename)
+        if aligned_chapters:
+            prefix = chapters_prefix or os.path.splitext(output_filename)[0]
+            sprite_filename = f"{prefix}.thumbnails.jpg"
+            shutil.copy(sprite.name, sprite_filename)
+            write_chapter_index(aligned_chapters, prefix, sprite_filename)
 
     return die()
 
 
+def find_config_dirs(config_filename: str) -> list[str]:
+    """Recursively search the current working directory for configuration files.
+
+    Params:
+        config_filename: filename of configuration files to look for
+
+    Returns:
+        list of absolute paths of directories containing a configuration file.
+    """
+    search_dirs = []
+    for entry, _, files in os.walk(os.getcwd()):
+        if config_filename in files:
+            search_dirs.append(os.path.abspath(entry))
+    return search_dirs
+
+
+def prepare_configs(
+    search_dirs: list[str], config_filename: str
+) -> tuple[list[tuple[str, Config]], list[str]]:
+    """Prepare the configuration file found in each directory.
+
+    Params:
+        search_dirs: directories containing a configuration file
+        config_filename: filename of the configuration files
+
+    Returns:
+        (prepared, unparsed), where:
+            - prepared is a list of (directory, prepared configuration)
+            - unparsed is a list of directories whose configuration could not be prepared
+    """
+    working_directory = os.getcwd()
+    prepared, unparsed = [], []
+    for i, dir in enumerate(search_dirs):
+        os.chdir(dir)  # Must happen before parsing config
+        success, config = prepare_config(os.path.join(dir, config_filename))
+        if not success:
+            unparsed.append(dir)
+            print_warn(
+                f"Could not prepare configuration: '{os.path.join(dir, config_filename)}'"
+            )
+            continue
+        prepared.append((dir, config))
+        print_info(f"Processed {i+1}/{len(search_dirs)} configurations")
+    os.chdir(working_directory)
+    return prepared, unparsed
+
+
+def print_crawl_summary(
+    good: list[str], bad: list[str], unparsed: list[str], total: int
+) -> None:
+    """Print which directories were recorded with and without issues.
+
+    Params:
+        good: directories recorded without issue
+        bad: directories where recording failed
+        unparsed: directories whose configuration could not be parsed
+        total: number of configurations that were recorded
+    """
+    prefix = "\n  - "
+    good_message = prefix + prefix.join(good)
+    bad_message = prefix + prefix.join(bad)
+    unparsed_message = prefix + prefix.join(unparsed)
+    if len(good) > 0:
+        print_info(
+            f"Recorded {len(good)}/{total} configurations with no issue {good_message}"
+        )
+        print()
+    if len(bad) > 0:
+        print_warn(
+            f"Encountered errors when recording {len(bad)}/{total} configurations {bad_message}"
+        )
+        print()
+
+    if len(unparsed) > 0:
+        print_warn(
+            f"Could not parse {len(unparsed)} configuration file(s) {unparsed_message}"
+        )
+        print()
+
+
 def do_crawl(
     config_filename: str,
     output_filename: str,
@@ -317,6 +487,7 @@ def do_crawl(
     rows: int = 20,
     font_size: int = 20,
     overwrite_output: bool = True,
+    chapters: bool = False,
 ) -> None:
     """Crawl mode: search directory for configuration files and execute record mode
     in each directory.
@@ -329,6 +500,7 @@ def do_crawl(
         cols: terminal column width (passed to agg)
         font_size: terminal font size (passed to agg)
         overwrite_output: don't ask before overwriting output_filename
+        chapters: also write a chapter index and thumbnail sprite sheet
     """
     print_warn("Crawling support is experimental")
     if dry_run:
@@ -339,27 +511,13 @@ def do_crawl(
         print_error("record.py not found in PATH")
         exit(1)
 
-    search_dirs = []
-    for entry, _, files in os.walk(os.getcwd()):
-        if config_filename in files:
-            search_dirs.append(os.path.abspath(entry))
+    search_dirs = find_config_dirs(config_filename)
 
     print_info(f"Found {len(search_dirs)} configuration files.")
     print_info(f"Warming up, please be patient")
 
-    tasks, unparsed = [], []
-    for i, dir in enumerate(search_dirs):
-        os.chdir(dir)  # Must happen before parsing config
-        success, config = prepare_config(os.path.join(dir, config_filename))
-        if not success:
-            unparsed.append(dir)
-            print_warn(
-                f"Could not prepare configuration: '{os.path.join(dir, config_filename)}'"
-            )
-            continue
-        pickled_filename = pickle_config(config).name
-        tasks.append((dir, pickled_filename))
-        print_info(f"Processed {i+1}/{len(search_dirs)} configurations")
+    prepared, unparsed = prepare_configs(search_dirs, config_filename)
+    tasks = [(dir, pickle_config(config).name) for dir, config in prepared]
 
     good, bad = [], []
     for dir, pickled_filename in tasks:
@@ -375,6 +533,7 @@ def do_crawl(
             dir=dir,
             pickled=True,
             overwrite_output=overwrite_output,
+            chapters=chapters,
         )
         os.remove(pickled_filename)
         if result:
@@ -382,29 +541,204 @@ def do_crawl(
         else:
             bad.append(dir)
 
-    prefix = "\n  - "
-    good_message = prefix + prefix.join(good)
-    bad_message = prefix + prefix.join(bad)
-    unparsed_message = prefix + prefix.join(unparsed)
-    if len(good) > 0:
-        print_info(
-            f"Recorded {len(good)}/{len(tasks)} configurations with no issue {good_message}"
-        )
-        print()
-    if len(bad) > 0:
-        print_warn(
-            f"Encountered errors when recording {len(bad)}/{len(tasks)} configurations {bad_message}"
-        )
-        print()
-
-    if len(unparsed) > 0:
-        print_warn(
-            f"Could not parse {len(unparsed)} configuration file(s) {unparsed_message}"
-        )
-        print()
+    print_crawl_summary(good, bad, unparsed, len(tasks))
     os.chdir(working_directory)
 
 
+def do_crawl_distributed(
+    config_filename: str,
+    output_filename: str,
+    queue_dir: str,
+    workers: int = 0,
+    theme: str = "monokai",
+    cols: int = 80,
+    rows: int = 20,
+    font_size: int = 20,
+    overwrite_output: bool = True,
+    chapters: bool = False,
+    poll_interval: float = 2.0,
+    timeout: float | None = 24 * 60 * 60,
+    lease: float = LEASE,
+) -> None:
+    """Distributed crawl mode: seed a job queue with every configuration found and
+    collect the results recorded by workers.
+
+    Workers are started with 'record.py worker --queue <queue_dir>' on any host
+    that mounts queue_dir and the crawled directories at the same paths.
+
+    Params:
+        config_filename: filename of configuration files to look for
+        output_filename: filename for recorded videos
+        queue_dir: directory on a shared filesystem to hold the job queue
+        workers: number of workers to start on this machine
+        theme: terminal theme (passed to agg)
+        cols: terminal column width (passed to agg)
+        font_size: terminal font size (passed to agg)
+        overwrite_output: don't ask before overwriting output_filename
+        chapters: also write a chapter index and thumbnail sprite sheet
+        poll_interval: seconds to wait between checks for new results
+        timeout: seconds to wait for results before giving up (None: wait forever)
+        lease: seconds before the claim of a worker that stopped responding expires
+    """
+    print_warn("Distributed crawling support is experimental")
+
+    queue = JobQueue(queue_dir)
+    if not queue.create():
+        print_error(f"Queue directory '{queue.path}' already contains jobs")
+        exit(1)
+
+    search_dirs = find_config_dirs(config_filename)
+    print_info(f"Found {len(search_dirs)} configuration files.")
+    print_info("Warming up, please be patient")
+
+    prepared, unparsed = prepare_configs(search_dirs, config_filename)
+    options = {
+        "theme": theme,
+        "cols": cols,
+        "rows": rows,
+        "font_size": font_size,
+        "chapters": chapters,
+    }
+    jobs = []
+    for dir, config in prepared:
+        # Workers can't prompt, so ask before seeding the queue
+        if not overwrite_output and not should_make_output_file(
+            os.path.join(dir, output_filename)
+        ):
+            continue
+        job = Job(f"{len(jobs):05d}", dir, config, output_filename, options)
+        queue.put(job)
+        jobs.append(job)
+    queue.seal()
+    print_info(f"Seeded {len(jobs)} jobs in '{queue.path}'")
+
+    local_workers = [
+        subprocess.Popen(["record.py", "worker", "--queue", queue.path])
+        for _ in range(workers)
+    ]
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    results = []
+    while len(results) < len(jobs):
+        time.sleep(poll_interval)
+        for job_id in queue.requeue_stale(lease):
+            print_warn(f"Worker on job {job_id} stopped responding, job queued again")
+        previous, results = len(results), queue.results()
+        if len(results) > previous:
+            print_info(f"Collected {len(results)}/{len(jobs)} results")
+        if local_workers and all(w.poll() is not None for w in local_workers):
+            # Local workers are done, any missing results would never arrive
+            results = queue.results()
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            print_warn(f"No results for {len(jobs) - len(results)} jobs after {timeout}s")
+            break
+
+    for worker in local_workers:
+        if worker.poll() is None:
+            worker.terminate()
+
+    for worker in local_workers:
+        worker.wait()
+
+    finished = {result.id for result in results}
+    good = [f"{r.dir} ({r.host})" for r in results if r.success]
+    bad = [
+        f"{r.dir} ({r.host}: {r.error})" if r.error else f"{r.dir} ({r.host})"
+        for r in results
+        if not r.success
+    ]
+    for job in jobs:
+        if job.id not in finished:
+            claimed_by = queue.claimed_by(job.id) or "no worker"
+            bad.append(f"{job.dir} (no result, claimed by {claimed_by})")
+    print_crawl_summary(good, bad, unparsed, len(jobs))
+
+    # Workers still polling stop once the queue is gone
+    queue.remove()
+
+
+def do_worker(queue_dir: str, poll_interval: float = 2.0, lease: float = LEASE) -> int:
+    """Worker mode: claim jobs from a shared job queue and record them.
+
+    The worker stops once the queue is sealed and every job has a result,
+    or once the coordinator removed the queue.
+    Until then it also takes over jobs whose worker stopped renewing its claim.
+    Videos are written to a temporary file first and renamed into place,
+    so a video is never observed half written. A job that raises is published
+    as failed, so the coordinator never waits for it.
+
+    Params:
+        queue_dir: directory holding the job queue
+        poll_interval: seconds to wait before checking for new jobs
+        lease: seconds before the claim of a worker that stopped responding expires
+
+    Returns:
+        Number of jobs recorded by this worker.
+    """
+    queue = JobQueue(queue_dir)
+    if not queue.exists():
+        print_error(f"'{queue.path}' is not a job queue")
+        return 0
+
+    working_directory = os.getcwd()
+    host, pid = worker_name().rsplit(":", 1)
+    processed = 0
+    while True:
+        try:
+            queue.requeue_stale(lease)
+            job = queue.claim()
+        except FileNotFoundError:
+            break  # Queue removed by the coordinator
+        if job is None:
+            if queue.is_sealed() and queue.is_done():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        print_info(f"[{worker_name()}] Recording in {job.dir}")
+        started = time.time()
+        final_filename = os.path.join(job.dir, job.output_filename)
+        tmp_filename = f"{final_filename}.{host}.{pid}.tmp"
+        success, error = False, ""
+        with queue.heartbeat(job.id, lease):
+            pickled_filename = pickle_config(job.config).name
+            try:
+                success = do_record(
+                    config_filename=pickled_filename,
+                    output_filename=tmp_filename,
+                    dir=job.dir,
+                    pickled=True,
+                    overwrite_output=True,
+                    chapters_prefix=os.path.splitext(final_filename)[0],
+                    **job.options,
+                )
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print_error(f"[{worker_name()}] Recording in {job.dir} failed: {error}")
+            finally:
+                os.remove(pickled_filename)
+                os.chdir(working_directory)
+            if os.path.isfile(tmp_filename):
+                if success:
+                    os.replace(tmp_filename, final_filename)
+                else:
+                    os.remove(tmp_filename)
+
+        processed += 1
+        try:
+            queue.publish(
+                JobResult(
+                    job.id, job.dir, success, host, int(pid), started, time.time(), error
+                )
+            )
+        except FileNotFoundError:
+            break  # Queue removed by the coordinator
+
+    print_info(f"[{worker_name()}] Queue empty, recorded {processed} jobs")
+    return processed
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog="bit-record",
@@ -418,12 +752,14 @@ mode:
     crawl   Recursively search directory for configuration files
             and record a terminal video if a configuration is found
     run     Preview the video that would be generated when recording.
+    worker  Claim and record jobs from a distributed crawl queue
+            (see 'crawl --distributed')
 """,
     )
     parser.add_argument(
         "mode",
         nargs="?",
-        choices=["record", "crawl", "run"],
+        choices=["record", "crawl", "run", "worker"],
         default="record",
         help=argparse.SUPPRESS,
     )
@@ -470,6 +806,41 @@ Directory to recursively search for configuration files (crawl mode).
         required=False,
         help="""Dry run: try to parse configuration file and show result (record mode).""",
     )
+    distributed_opts = parser.add_argument_group(
+        "distributed options",
+        description="Options to spread recordings over several machines (crawl/worker mode)",
+    )
+    distributed_opts.add_argument(
+        "--distributed",
+        action="store_true",
+        required=False,
+        help="Seed a job queue for workers instead of recording directly (crawl mode).",
+    )
+    distributed_opts.add_argument(
+        "--queue",
+        metavar="PATH",
+        type=str,
+        required=False,
+        default=".record-queue",
+        help="""Job queue directory, must be on a filesystem shared by all workers.
+(default: '%(default)s')""",
+    )
+    distributed_opts.add_argument(
+        "--workers",
+        metavar="N",
+        default=0,
+        type=int,
+        required=False,
+        help="Number of workers to start on this machine (crawl mode). (default: '%(default)s')",
+    )
+    distributed_opts.add_argument(
+        "--timeout",
+        metavar="SECONDS",
+        default=24 * 60 * 60,
+        type=float,
+        required=False,
+        help="Stop waiting for results after this many seconds (crawl mode). (default: '%(default)s')",
+    )
     # TODO: suppress asciinema/ffmpeg output except when verbose
     # parser.add_argument(
     #     "-v",
@@ -513,11 +884,22 @@ Directory to recursively search for configuration files (crawl mode).
         required=False,
         help="Terminal column height. Option passed to agg. (default: '%(default)s')",
     )
+    extra_opts.add_argument(
+        "--chapters",
+        action="store_true",
+        required=False,
+        help="""Also write a chapter index (WebVTT/JSON) with a chapter per command
+and a thumbnail sprite sheet next to the output video.""",
+    )
     # Internal flags
     # Flag to indicate whether configuration file is pickled
     parser.add_argument(
         "-p", required=False, action="store_true", help=argparse.SUPPRESS
     )
+    # File to store the start time of each command in (run mode)
+    parser.add_argument(
+        "--chapters-file", required=False, default="", help=argparse.SUPPRESS
+    )
 
     opts = parser.parse_args()
     if opts.dir and os.path.isdir(opts.dir):
@@ -539,6 +921,21 @@ Directory to recursively search for configuration files (crawl mode).
                 font_size=opts.font_size,
                 pickled=opts.p,
                 overwrite_output=True,
+                chapters=opts.chapters,
+            )
+        case "crawl" if opts.distributed:
+            do_crawl_distributed(
+                config_filename=opts.config,
+                output_filename=opts.output,
+                queue_dir=opts.queue,
+                workers=opts.workers,
+                timeout=opts.timeout,
+                theme=opts.theme,
+                cols=opts.cols,
+                rows=opts.rows,
+                font_size=opts.font_size,
+                overwrite_output=opts.yes,
+                chapters=opts.chapters,
             )
         case "crawl":
             do_crawl(
@@ -550,9 +947,16 @@ Directory to recursively search for configuration files (crawl mode).
                 rows=opts.rows,
                 font_size=opts.font_size,
                 overwrite_output=opts.yes,
+                chapters=opts.chapters,
             )
+        case "worker":
+            do_worker(queue_dir=opts.queue)
         case "run":
-            success, _ = do_run(config_filename=opts.config, pickled=opts.p)
+            success, _ = do_run(
+                config_filename=opts.config,
+                pickled=opts.p,
+                chapters_filename=opts.chapters_file,
+            )
             if not success:
                 exit(1)
         case _:
@@ -1,32 +1,182 @@
 import os
+import sys
+import json
+import math
+import hashlib
+import functools
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image, ImageDraw, ImageFont
 
-def add_watermark(input_image_path, output_image_path, watermark_text="NexEd"):
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+MANIFEST_FILE = ".watermark-manifest.json"
+
+WATERMARK_TEXT = "NexEd"
+WIDTH = 1024
+FONT_SIZE = 80
+COLOR = "orange"
+MARGIN = 30
+
+# Outputs made with other settings are out of date and watermarked again
+SETTINGS = {"text": WATERMARK_TEXT, "width": WIDTH, "font_size": FONT_SIZE, "color": COLOR, "margin": MARGIN}
+
+@functools.lru_cache(maxsize=32)
+def render_watermark(watermark_text, font_path=None, font_size=FONT_SIZE, color=COLOR):
+    # Loaded, measured and drawn once per worker, then composited onto every image
+    font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default(font_size)
+
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    text_width = math.ceil(measure.textlength(watermark_text, font=font))
+    text_height = measure.textbbox((0, 0), watermark_text, font=font)[3]
+
+    overlay = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
+    ImageDraw.Draw(overlay).text((0, 0), watermark_text, fill=color, font=font)
+    return overlay
+
+def add_watermark(input_image_path, output_image_path, watermark_text=WATERMARK_TEXT):
     original_image = Image.open(input_image_path)
 
-    width = 1024
+    width = WIDTH
     height = int((width / original_image.width) * original_image.height)
-    resized_image = original_image.resize((width, height))
+    # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding, no smaller than the target,
+    # and reduce other large images by whole factors before the final resampling
+    original_image.draft(original_image.mode, (width, height))
+    resized_image = original_image.resize((width, height), Image.Resampling.BICUBIC, reducing_gap=3.0)
+    if resized_image.mode not in ("RGB", "RGBA", "L", "LA"):
+        resized_image = resized_image.convert("RGBA" if "transparency" in resized_image.info else "RGB")
+
+    overlay = render_watermark(watermark_text)
 
-    draw = ImageDraw.Draw(resized_image)
+    x = resized_image.width - overlay.width - MARGIN
+    y = resized_image.height - overlay.height - MARGIN
 
-    font = ImageFont.load_default(80)
+    if resized_image.mode == "RGBA":
+        # Like drawing, clip the text on images too small to hold it
+        resized_image.alpha_composite(overlay, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
+    else:
+        resized_image.paste(overlay, (x, y), overlay)
 
-    text_width= draw.textlength(watermark_text, font=font)
-    text_height = draw.textbbox((0, 0), watermark_text, font=font)[3]
+    resized_image.save(output_image_path)
 
-    x = resized_image.width - text_width - 30
-    y = resized_image.height - text_height - 30
+def find_images(directory, skip_dir=None):
+    # os.scandir yields entries as it reads the directory, subdirectories included
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if os.path.abspath(entry.path) != skip_dir:
+                    yield from find_images(entry.path, skip_dir)
+            elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
 
-    draw.text((x, y), watermark_text, fill="orange", font=font)
+def output_path_for(input_path, input_dir, output_dir):
+    # Keep the subdirectories of the input, prefix the file name with wm_
+    directory, file = os.path.split(os.path.relpath(input_path, input_dir))
+    return os.path.join(output_dir, directory, f"wm_{file}")
 
-    resized_image.save(output_image_path)
-    print(f"Watermarked image saved as {output_image_path}")
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def is_up_to_date(entry, input_path, output_path):
+    if entry is None or "error" in entry or entry["settings"] != SETTINGS or not os.path.exists(output_path):
+        return False
+    # Only hash the source when its size or modification time changed
+    stat = os.stat(input_path)
+    if (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+        return True
+    if entry["hash"] != file_hash(input_path):
+        return False
+    entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+    return True
+
+def watermark_file(input_path, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    stat = os.stat(input_path)
+    digest = file_hash(input_path)
+    add_watermark(input_path, output_path)
+    return {"hash": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "settings": SETTINGS}
+
+def watermark_all(input_dir="images", output_dir="watermarked", workers=None, force=False):
+    """Watermark the new and changed images in input_dir on a process pool.
+
+    The manifest in output_dir records the source hash and settings of every output,
+    and the error of every image that failed, which is tried again on the next run.
+    Outputs of deleted sources are removed. Returns the number of images that failed,
+    a bad image doesn't stop the others.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    old_manifest = load_manifest(manifest_path)
+    manifest = {}
+    pending = {}
+    for input_path in find_images(input_dir, skip_dir=os.path.abspath(output_dir)):
+        source = os.path.relpath(input_path, input_dir)
+        output_path = output_path_for(input_path, input_dir, output_dir)
+        entry = old_manifest.pop(source, None)
+        if not force and is_up_to_date(entry, input_path, output_path):
+            manifest[source] = entry
+        else:
+            pending[input_path] = (source, output_path)
+
+    # What is left in the old manifest has no source anymore
+    for source in sorted(old_manifest):
+        output_path = output_path_for(os.path.join(input_dir, source), input_dir, output_dir)
+        try:
+            os.remove(output_path)
+            print(f"Removed {output_path}, {source} was deleted")
+        except FileNotFoundError:
+            pass
+
+    if manifest:
+        print(f"Skipped {len(manifest)} unchanged images")
+
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {
+                pool.submit(watermark_file, input_path, output_path): input_path
+                for input_path, (source, output_path) in pending.items()
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                input_path = futures[future]
+                source, output_path = pending[input_path]
+                try:
+                    manifest[source] = future.result()
+                    print(f"[{done}/{len(futures)}] Watermarked image saved as {output_path}")
+                except Exception as e:
+                    # Recorded so a stale output is still removed once the source is deleted,
+                    # the error makes the next run try it again
+                    manifest[source] = {"error": str(e)}
+                    failed += 1
+                    print(f"[{done}/{len(futures)}] Could not watermark {input_path}: {e}", file=sys.stderr)
+    finally:
+        save_manifest(manifest_path, manifest)
+    return failed
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add a watermark to every image in a directory.")
+    parser.add_argument("input_dir", nargs="?", default="images", help="directory with images (default: %(default)s)")
+    parser.add_argument("output_dir", nargs="?", default="watermarked", help="directory for watermarked images (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-f", "--force", action="store_true", help="watermark every image again, even if unchanged")
+    args = parser.parse_args()
 
-    for file in os.listdir("images"):
-        if file.endswith(".jpg")  or file.endswith(".png") or file.endswith(".jpeg"):
-            input_path = os.path.join("images", file)
-            output_path = os.path.join("watermarked", f"wm_{file}")
-            add_watermark(input_path, output_path)
+    failed = watermark_all(args.input_dir, args.output_dir, args.workers, args.force)
+    if failed:
+        print(f"{failed} images could not be watermarked", file=sys.stderr)
+        sys.exit(1)